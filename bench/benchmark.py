@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""Benchmark of calendar and gantt chart request paths.
+
+Creates a throwaway SQLite environment, fills it with synthetic projects
+and times `TicketGanttChart` and `TicketCalendar` requests for every zoom
+mode, weekly and monthly views and filter combinations.
+
+Usage::
+
+    python bench/benchmark.py [--tickets 1000,10000] [--repeat 3] ...
+
+For every scenario the following values are reported (milliseconds, best
+of `--repeat` runs):
+
+ * `sql`   - schedule query execution and fetching of its rows,
+ * `py`    - rest of the request processing with a cold schedule cache
+             (row conversion, bar geometry, milestones, components),
+ * `warm`  - request processing with a warm schedule cache,
+ * `render`- template rendering and serialization,
+ * `bytes` - size of the rendered page.
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from optparse import OptionParser
+
+from trac.env import Environment
+from trac.test import Mock, MockPerm
+from trac.util.datefmt import to_utimestamp, utc
+from trac.web.api import _RequestArgs
+from trac.web.chrome import Chrome
+from trac.web.href import Href
+
+from trac.project.api import ProjectManagement
+
+from ganttcalendar.api import ScheduleQuery
+from ganttcalendar.schedule import GanttScheduleStore
+from ganttcalendar.ticketgantt import TicketGanttChart
+from ganttcalendar.ticketcalendar import TicketCalendar
+
+
+def create_env(path):
+    options = [
+        ('components', 'ganttcalendar.*', 'enabled'),
+        ('ticket-custom', 'due_assign', 'text'),
+        ('ticket-custom', 'due_close', 'text'),
+        ('ticket-custom', 'complete', 'text'),
+        ('ticket-custom', 'estimatedhours', 'text'),
+        ('ticket-custom', 'totalhours', 'text'),
+    ]
+    return Environment(path, create=True, options=options)
+
+def populate(env, pid, tickets, spread, milestones, components, start, rnd):
+    """Insert synthetic project `pid` and return its milestone and
+    component names."""
+    milestone_names = ['milestone%d' % i for i in range(milestones)]
+    component_names = ['component%d' % i for i in range(components)]
+    owners = ['user%d' % i for i in range(20)]
+    now = to_utimestamp(datetime.now(utc))
+
+    @env.with_transaction()
+    def do_populate(db):
+        cursor = db.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM ticket")
+        first_id = cursor.fetchone()[0] + 1
+        for i, name in enumerate(milestone_names):
+            due = datetime.combine(start + timedelta(spread * (i + 1) / milestones),
+                                   datetime.min.time()).replace(tzinfo=utc)
+            cursor.execute("INSERT INTO milestone (name, due, completed, description, project_id) "
+                           "VALUES (%s, %s, 0, %s, %s)",
+                           ('%s-%d' % (name, pid), to_utimestamp(due), 'Milestone ' + name, pid))
+        for name in component_names:
+            cursor.execute("INSERT INTO component (name, owner, description, project_id) "
+                           "VALUES (%s, %s, '', %s)", ('%s-%d' % (name, pid), owners[0], pid))
+
+        rows = []
+        custom = []
+        for id_ in range(first_id, first_id + tickets):
+            due_assign = start + timedelta(rnd.randint(0, spread))
+            due_close  = due_assign + timedelta(rnd.randint(0, 30))
+            status = rnd.choice(('new', 'assigned', 'closed'))
+            rows.append((id_, 'task', 'Synthetic ticket %d' % id_, rnd.choice(owners),
+                         'Description of ticket %d\n' % id_ * rnd.randint(1, 20),
+                         status, status == 'closed' and 'fixed' or '', 'major',
+                         milestones and '%s-%d' % (rnd.choice(milestone_names), pid) or '',
+                         components and '%s-%d' % (rnd.choice(component_names), pid) or '',
+                         pid, now, now))
+            custom.extend([(id_, 'due_assign', due_assign.isoformat()),
+                           (id_, 'due_close', due_close.isoformat()),
+                           (id_, 'complete', str(rnd.randint(0, 100))),
+                           (id_, 'estimatedhours', str(rnd.randint(1, 40))),
+                           (id_, 'totalhours', str(rnd.randint(0, 40)))])
+        cursor.executemany("INSERT INTO ticket (id, type, summary, owner, description, "
+                           "status, resolution, priority, milestone, component, "
+                           "project_id, time, changetime) "
+                           "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", rows)
+        cursor.executemany("INSERT INTO ticket_custom (ticket, name, value) "
+                           "VALUES (%s,%s,%s)", custom)
+        GanttScheduleStore(env).resync(db)
+
+    return ['%s-%d' % (n, pid) for n in milestone_names], \
+           ['%s-%d' % (n, pid) for n in component_names]
+
+def make_req(env, path, args):
+    return Mock(path_info=path, method='GET', args=_RequestArgs(args),
+                authname='user0', perm=MockPerm(), session={}, locale=None, tz=utc,
+                href=Href('/trac'), abs_href=Href('http://localhost/trac'),
+                base_path='/trac', form_token=None, callbacks={},
+                chrome={'links': {}, 'scripts': [], 'script_data': {},
+                        'ctxtnav': [], 'warnings': [], 'notices': []},
+                get_header=lambda name: None,
+                check_modified=lambda datetime, extra='': None,
+                send_header=lambda name, value: None)
+
+def best(func, repeat):
+    times = []
+    result = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return min(times) * 1000, result
+
+def scenarios(milestones, components, start):
+    filters = [
+        ('all', {}),
+        ('mine', {'show_my_ticket': 'on'}),
+        ('open', {'hide_closed_ticket': 'on'}),
+    ]
+    if milestones:
+        filters.append(('milestone', {'selected_milestone': milestones[0]}))
+    if components:
+        filters.append(('component', {'selected_component': components[0]}))
+    month = {'year': str(start.year), 'month': str(start.month)}
+
+    for name, args in filters:
+        for zoom in range(1, 7):
+            for sort in ('milestone', 'component'):
+                a = dict(month, zoom=str(zoom), sorted_field=sort, **args)
+                yield 'gantt zoom=%d sort=%s %s' % (zoom, sort, name), \
+                      TicketGanttChart, '/ticketgantt', a
+        for weekly in (0, 1):
+            a = dict(month, weekly=str(weekly), **args)
+            yield 'calendar %s %s' % (weekly and 'weekly' or 'monthly', name), \
+                  TicketCalendar, '/ticketcalendar', a
+
+def measure(env, handler, path, args, repeat):
+    schedule = ScheduleQuery(env)
+    chrome = Chrome(env)
+    select = schedule._select
+
+    def cold():
+        schedule.invalidate()
+        timing = {}
+        def timed_select(*args):
+            start = time.time()
+            rows = list(select(*args))
+            timing['sql'] = time.time() - start
+            timing['rows'] = len(rows)
+            return rows
+        schedule._select = timed_select
+        try:
+            start = time.time()
+            handler(env).process_request(make_req(env, path, args))
+            timing['total'] = time.time() - start
+        finally:
+            del schedule._select
+        return timing
+    timings = [cold() for i in range(repeat)]
+    t_sql = min(t['sql'] for t in timings) * 1000
+    t_py  = min(t['total'] - t['sql'] for t in timings) * 1000
+    rows  = timings[0]['rows']
+
+    def warm():
+        return handler(env).process_request(make_req(env, path, args))
+    t_warm, result = best(warm, repeat)
+
+    template, data, content_type = result
+    req = make_req(env, path, args)
+    t_render, output = best(lambda: chrome.render_template(req, template, data, 'text/html'),
+                            repeat)
+    return rows, t_sql, t_py, t_warm, t_render, len(output)
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--tickets', default='1000,10000',
+                      help='comma separated ticket counts of generated projects '
+                           '[default: %default]')
+    parser.add_option('--spread', type='int', default=365,
+                      help='days the ticket start dates are spread over [default: %default]')
+    parser.add_option('--milestones', type='int', default=10,
+                      help='milestones per project [default: %default]')
+    parser.add_option('--components', type='int', default=5,
+                      help='components per project [default: %default]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs per measurement, best one is reported [default: %default]')
+    parser.add_option('--filter', default='',
+                      help='only run scenarios containing this text')
+    parser.add_option('--seed', type='int', default=1)
+    parser.add_option('--keep', action='store_true',
+                      help='do not remove the generated environment')
+    options, args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='ganttcalendar-bench-')
+    try:
+        env = create_env(os.path.join(path, 'env'))
+        rnd = random.Random(options.seed)
+        start = date.today().replace(day=1)
+        pm = ProjectManagement(env)
+
+        print('%-45s %7s %9s %9s %9s %9s %10s' % ('scenario', 'rows', 'sql', 'py',
+                                                  'warm', 'render', 'bytes'))
+        for pid, count in enumerate(options.tickets.split(',')):
+            pid += 1
+            count = int(count)
+            t_populate, names = best(lambda: populate(env, pid, count, options.spread,
+                                                      options.milestones, options.components,
+                                                      start, rnd), 1)
+            milestones, components = names
+            print('# project %d: %d tickets, generated in %.0f ms' % (pid, count, t_populate))
+
+            pm.get_current_project = lambda req: pid
+            for name, handler, req_path, req_args in scenarios(milestones, components, start):
+                if options.filter not in name:
+                    continue
+                rows, t_sql, t_py, t_warm, t_render, size = \
+                        measure(env, handler, req_path, req_args, options.repeat)
+                print('%-45s %7d %9.1f %9.1f %9.1f %9.1f %10d' % (name, rows, t_sql, t_py,
+                                                                  t_warm, t_render, size))
+                sys.stdout.flush()
+    finally:
+        if options.keep:
+            print('# environment kept in', path)
+        else:
+            shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,10 @@ from ticketcalendar import *
 from ticketgantt import *
 from ticketvalidator import *
 from complete_by_close import *
+from schedule import *
+from criticalpath import *
+from workload import *
+from export import *
+from live import *
+from workcalendar import *
+from baseline import *
@@ -1,14 +1,32 @@
-from datetime import date
+import errno
+import socket
+import sys
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import partial
+from threading import RLock
 from pkg_resources import resource_filename
 
 from trac.core import Component, implements
-from trac.config import IntOption
+from trac.config import BoolOption, IntOption
+from trac.db.api import DatabaseManager, _parse_db_str
+from trac.mimeview.api import Context
+from trac.resource import ResourceNotFound
+from trac.util.datefmt import from_utimestamp, to_utimestamp, utc
+from trac.util.text import shorten_line
 from trac.util.translation import domain_functions
+from trac.wiki.formatter import format_to_html
 
-from trac.web.chrome import ITemplateProvider
+from trac.util.presentation import to_json
+from trac.web.api import RequestDone
+from trac.web.chrome import ITemplateProvider, ITemplateStreamFilter
+from trac.ticket.api import ITicketChangeListener, IMilestoneChangeListener, \
+                            TicketSystem, convert_field_value
+from trac.ticket import model
 
 
-__all__ = ['TracGanttCalendar']
+__all__ = ['TracGanttCalendar', 'ScheduleQuery']
 
 
 add_domain, _, N_, gettext, ngettext, tag_ = \
@@ -42,23 +60,194 @@ weekdays = (
 
 date_format = '%Y-%m-%d' # ISO 8601
 
+# `system` table entry changed by bulk updates of schedules
+generation_key = 'ganttcalendar_generation'
+
 def add_months(year, month, months):
     month = month + months - 1
     nyear  = year + month / 12
     nmonth = month % 12 + 1
     return date(nyear, nmonth, 1)
 
+def to_date(value):
+    """Return `value` as `date`, parsing ISO date strings. Returns `None`
+    for empty or invalid values."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(value.strip()[:10], date_format).date()
+    except (AttributeError, ValueError):
+        return None
+
+def to_columns(items, columns):
+    """Turn a list of dicts into a dict of lists (one per column) ready
+    to be sent as JSON. Dates are converted to ISO 8601 strings."""
+    result = {}
+    for column in columns:
+        values = [item.get(column) for item in items]
+        result[column] = [isinstance(v, date) and v.isoformat() or v
+                          for v in values]
+    return result
+
+def send_json(req, data, status=200):
+    req.send(to_json(data), 'application/json', status)
+
+def send_stream(req, chunks, content_type, chunk_size=8192):
+    """Send response body made of encoded `chunks` while they are produced.
+
+    Content length is not known in advance, so data is passed straight to
+    the WSGI server, which uses chunked transfer encoding for it.
+    """
+    req.send_response(200)
+    req.send_header('Content-Type', content_type)
+    req.end_headers()
+    if req.method != 'HEAD':
+        buf = []
+        size = 0
+        try:
+            for chunk in chunks:
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= chunk_size:
+                    req._write(''.join(buf))
+                    buf = []
+                    size = 0
+            if buf:
+                req._write(''.join(buf))
+        except (IOError, socket.error) as e:
+            if e.args[0] not in (errno.EPIPE, errno.ECONNRESET, 10053, 10054):
+                raise
+    raise RequestDone
+
+
+class DayBuckets(object):
+    """Map the days of the range `first`..`last` (inclusive) to the ticket
+    and milestone markers falling on them.
+
+    Tickets and milestones are added one by one and go straight to the
+    buckets of their boundary days, so filling the buckets costs
+    O(tickets + milestones + days) instead of checking every item against
+    every day.
+    """
+
+    def __init__(self, first, last):
+        self.first = first
+        self.last  = last
+        self.tickets    = {}
+        self.milestones = {}
+
+    def add_ticket(self, num, due_assign, due_close):
+        """Add ticket with index `num`: marker 'bw' goes to the day when
+        ticket both starts and ends, 'from' and 'to' - to start and end days.
+        """
+        if due_assign == due_close:
+            self._add(self.tickets, due_assign, {'img': 'bw', 'num': num})
+        else:
+            self._add(self.tickets, due_assign, {'img': 'from', 'num': num})
+            self._add(self.tickets, due_close, {'img': 'to', 'num': num})
+
+    def add_milestone(self, num, due):
+        self._add(self.milestones, due, num)
+
+    def days(self):
+        """Iterate over `(day, ticket_markers, milestone_nums)` for every
+        day of the range."""
+        for d in range((self.last - self.first).days + 1):
+            day = self.first + timedelta(d)
+            yield day, self.tickets.get(day, []), self.milestones.get(day, [])
+
+    def _add(self, buckets, day, item):
+        if day is None or not self.first <= day <= self.last:
+            return
+        buckets.setdefault(day, []).append(item)
+
+
+class RequestTimer(object):
+    """Durations and counters of request processing phases."""
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = []
+        self.counters = []
+
+    def phase(self, name):
+        """Return context manager measuring duration of phase `name`."""
+        return _TimerPhase(self, name)
+
+    def count(self, name, value):
+        self.counters.append((name, value))
+
+    def server_timing(self):
+        """Return value of `Server-Timing` header."""
+        metrics = ['%s;dur=%.1f' % (name, duration * 1000)
+                   for name, duration in self.phases]
+        metrics.extend('%s;desc=%s' % item for item in self.counters)
+        return ', '.join(metrics)
+
+    def __str__(self):
+        items = ['%s=%.1fms' % (name, duration * 1000) for name, duration in self.phases]
+        items.extend('%s=%s' % item for item in self.counters)
+        return ' '.join(items)
+
+
+class _TimerPhase(object):
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.timer.phases.append((self.name, time.time() - self.start))
+
+
+class NullTimer(object):
+    """Timer doing nothing, used when request timing is disabled."""
+
+    enabled = False
+
+    def phase(self, name):
+        return self
+
+    def count(self, name, value):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+null_timer = NullTimer()
+
 
 class TracGanttCalendar(Component):
 
-    implements(ITemplateProvider)
+    implements(ITemplateProvider, ITemplateStreamFilter)
 
     first_day = IntOption('ganttcalendar', 'first_day', '0',
             doc='Begin of week: 0 == Sunday, 1 == Monday')
+    lazy_description = BoolOption('ganttcalendar', 'lazy_description', 'true',
+            doc='Load ticket descriptions of calendar and gantchart popups on demand')
+    description_length = IntOption('ganttcalendar', 'description_length', '1000',
+            doc='Maximum length of ticket description loaded on demand')
+    request_timing = BoolOption('ganttcalendar', 'request_timing', 'false',
+            doc='Measure calendar and gantchart request phases, send them in '
+                'Server-Timing header and log them')
 
     def __init__(self):
         locale_dir = resource_filename(__name__, 'locale')
         add_domain(self.env.path, locale_dir)
+        self._options = {}
+        self._options_mtime = None
+        self._options_lock = RLock()
 
     # ITemplateProvider
 
@@ -68,3 +257,526 @@ class TracGanttCalendar(Component):
     def get_htdocs_dirs(self):
         return [('ganttcalendar', resource_filename(__name__, 'htdocs'))]
 
+    # ITemplateStreamFilter
+
+    def filter_stream(self, req, method, filename, stream, data):
+        timer = data and data.get('request_timer')
+        if not timer or not timer.enabled:
+            return stream
+        return self._timed_stream(req, stream, timer)
+
+    def _timed_stream(self, req, stream, timer):
+        with timer.phase('render'):
+            for event in stream:
+                yield event
+        self.log_timing(req, timer)
+
+    #
+
+    def get_timer(self):
+        """Return new `RequestTimer` if request timing is enabled, a
+        `NullTimer` otherwise."""
+        if self.request_timing:
+            return RequestTimer()
+        return null_timer
+
+    def send_timing(self, req, timer):
+        """Send measured phases in `Server-Timing` header. Template
+        rendering is only logged, as it happens after headers are sent."""
+        if timer.enabled:
+            req.send_header('Server-Timing', timer.server_timing())
+
+    def log_timing(self, req, timer):
+        if timer.enabled:
+            self.log.info('ganttcalendar timing: path=%s %s', req.path_info, timer)
+
+    def syllabus_option(self, component, name, syllabus_id):
+        """Return value of switcher option `name` of `component` for syllabus
+        `syllabus_id`. Values are parsed once per syllabus and kept until the
+        configuration file is reloaded."""
+        key = (component.__class__.__name__, name, syllabus_id)
+        mtime = getattr(self.config, '_lastmtime', None)
+        self._options_lock.acquire()
+        try:
+            if mtime != self._options_mtime:
+                self._options.clear()
+                self._options_mtime = mtime
+            if key in self._options:
+                return self._options[key]
+        finally:
+            self._options_lock.release()
+        value = getattr(component, name).syllabus(syllabus_id)
+        self._options_lock.acquire()
+        try:
+            if mtime == self._options_mtime:
+                self._options[key] = value
+        finally:
+            self._options_lock.release()
+        return value
+
+    def send_description(self, req, tkt_id):
+        """Send shortened ticket description rendered as HTML fragment."""
+        req.perm('ticket', tkt_id).require('TICKET_VIEW')
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT description FROM ticket WHERE id=%s", (tkt_id,))
+        row = cursor.fetchone()
+        if not row:
+            raise ResourceNotFound(_('Ticket %(id)s does not exist.', id=tkt_id))
+        text = shorten_line(row[0] or '', self.description_length)
+        context = Context.from_request(req, 'ticket', tkt_id)
+        html = format_to_html(self.env, context, text)
+        req.send(unicode(html).encode('utf-8'), 'text/html')
+
+
+
+class LRUCache(object):
+    """Thread-safe LRU mapping limited by the total size of its values.
+
+    `sizeof` is called once per stored value and returns its estimated
+    size in bytes. Least recently used entries are evicted when the total
+    exceeds `max_size`; values bigger than `max_size` are not stored.
+    """
+
+    def __init__(self, max_size, sizeof=sys.getsizeof):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._entries[key] = entry
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        self._lock.acquire()
+        try:
+            self._remove(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+        finally:
+            self._lock.release()
+
+    def discard(self, predicate=None):
+        """Remove entries whose key matches `predicate` (all by default)."""
+        self._lock.acquire()
+        try:
+            for key in self._entries.keys():
+                if predicate is None or predicate(key):
+                    self._remove(key)
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class ScheduleRow(object):
+    """Scheduled ticket, with slots for the values views add to it.
+
+    Rows support the mapping access used by views and templates: values
+    are read with `row[name]` or `row.get(name)` and set with
+    `row[name] = value`. Slots not set yet are missing, `get` returns
+    `None` for them.
+    """
+
+    columns = ('id', 'type', 'summary', 'owner', 'description', 'status',
+               'resolution', 'priority', 'due_assign', 'due_close', 'complete',
+               'estimatedhours', 'totalhours', 'milestone', 'component', 'changetime')
+
+    __slots__ = columns + (
+        # project and critical path
+        'pid', 'project', 'milestone_due', 'critical', 'slack',
+        'early_finish', 'late_finish', 'cycle',
+        # chart geometry in days from the first chart day
+        'all_start', 'all_end', 'done_start', 'done_end', 'late_start', 'late_end',
+        'todo_start', 'todo_end', 'slack_start', 'slack_end',
+        # baseline bar and slip of the close date in working days
+        'baseline_start', 'baseline_end', 'baseline_assign', 'baseline_close', 'slip',
+        # gantt chart labels
+        'due_label', 'tip',
+    )
+
+    def __init__(self, id, type, summary, owner, description, status, resolution,
+                 priority, due_assign, due_close, complete, estimatedhours, totalhours,
+                 milestone, component, changetime=None):
+        self.id = id
+        self.type = type
+        self.summary = summary
+        self.owner = owner
+        self.description = description
+        self.status = status
+        self.resolution = resolution
+        self.priority = priority
+        self.due_assign = due_assign
+        self.due_close = due_close
+        self.complete = complete
+        self.estimatedhours = estimatedhours
+        self.totalhours = totalhours
+        self.milestone = milestone
+        self.component = component
+        self.changetime = changetime
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def update(self, values):
+        for name, value in values.iteritems():
+            setattr(self, name, value)
+
+    def copy(self):
+        """Return a copy of the row with its `columns` values."""
+        return ScheduleRow(*[getattr(self, name) for name in self.columns])
+
+    def __repr__(self):
+        return '<ScheduleRow #%s %s ~ %s>' % (self.id, self.due_assign, self.due_close)
+
+
+class ScheduleFields(object):
+    """Schedule field definitions of a project with converters of their
+    values bound to the definitions.
+
+    `complete`, `estimatedhours` and `totalhours` are field dicts or `None`
+    if the project does not define the field, `names` holds names of all
+    ticket fields of the project.
+    """
+
+    def __init__(self, fields):
+        self.names = frozenset(fields)
+        self.complete = fields.get('complete')
+        self.estimatedhours = fields.get('estimatedhours')
+        self.totalhours = fields.get('totalhours')
+        self.time_tracking = self.estimatedhours is not None
+        self.to_complete = partial(convert_field_value, self.complete)
+        self.to_estimatedhours = partial(convert_field_value, self.estimatedhours)
+        self.to_totalhours = partial(convert_field_value, self.totalhours)
+
+
+def _schedule_size(entry):
+    tickets = entry[1][0]
+    size = sys.getsizeof(tickets)
+    for t in tickets:
+        size += sys.getsizeof(t) + sum(sys.getsizeof(getattr(t, name))
+                                       for name in ScheduleRow.columns)
+    return size
+
+
+class ScheduleQuery(Component):
+    """Scheduled tickets of a project for calendar and gantt chart.
+
+    Results are cached per project, date window and filter. Each entry
+    keeps the version of the project it was read at and is read again when
+    the version changes, so changes made by other processes are seen too.
+    Entries of a project are also dropped when its tickets or milestones
+    change in this process.
+    """
+
+    implements(ITicketChangeListener, IMilestoneChangeListener)
+
+    cache_size = IntOption('ganttcalendar', 'schedule_cache_size', '4194304',
+            doc='Memory budget of schedule query cache in bytes. 0 disables cache.')
+
+    # ticket columns tickets can be ordered by
+    sort_fields = ('milestone', 'component')
+
+    def __init__(self):
+        self._cache = LRUCache(self.cache_size, _schedule_size)
+        self.dialect = _parse_db_str(DatabaseManager(self.env).connection_uri)[0]
+        self._fields = {}
+        self._fields_mtime = None
+        self._fields_lock = RLock()
+
+    def get_tickets(self, pid, first, last, owner=None, show_closed=True,
+                    milestone=None, component=None, order=None,
+                    offset=0, limit=None, description=True, timer=null_timer):
+        """Return `(tickets, total, sum_estimatedhours, sum_totalhours)` for
+        tickets of project `pid` scheduled within `first`..`last`.
+
+        `tickets` is a list of `ScheduleRow`s owned by the caller, limited to `limit`
+        tickets starting from `offset`. `total` and sums cover all matching
+        tickets. Sums are `None` if time tracking fields are not defined.
+        Ticket descriptions are `None` unless `description` is true.
+        Query and row conversion phases are measured by `timer`.
+        Tickets are ordered by start date, within `order` field if it is one
+        of `sort_fields`.
+        """
+        if order not in self.sort_fields:
+            order = None
+        key = (pid, first, last, owner, show_closed, milestone, component, order,
+               description)
+        # read before the rows, a change committed in between only causes
+        # another fetch
+        version = self.get_version(pid)
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != version:
+            schedule = self._fetch(pid, first, last, owner, show_closed,
+                                   milestone, component, order, description, timer)
+            self._cache.set(key, (version, schedule))
+            timer.count('cache', 'miss')
+        else:
+            schedule = entry[1]
+            timer.count('cache', 'hit')
+        tickets, sum_estimatedhours, sum_totalhours = schedule
+        total = len(tickets)
+        timer.count('tickets', total)
+        if offset or limit:
+            tickets = tickets[offset:limit and offset + limit or None]
+        return [t.copy() for t in tickets], total, sum_estimatedhours, sum_totalhours
+
+    def iter_tickets(self, pid, first, last, owner=None, show_closed=True,
+                     milestone=None, component=None, order=None, description=False):
+        """Yield tickets selected like in `get_tickets` one by one, as they
+        are read from the database. Results are not cached."""
+        if order not in self.sort_fields:
+            order = None
+        fields = self.get_fields(pid)
+        rows = self._select(pid, first, last, owner, show_closed, milestone, component,
+                            order, description)
+        return self._iter_tickets(rows, fields)
+
+    def count_tickets(self, pid, first, last, owner=None, show_closed=True,
+                      milestone=None, component=None):
+        """Return number of tickets `iter_tickets` yields for the same
+        arguments."""
+        condition, args = self._where(pid, first, last, owner, show_closed, milestone,
+                                      component)
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM ganttcalendar_schedule s
+            JOIN ticket t ON t.id = s.ticket
+            %s AND s.due_assign <= s.due_close
+            """ % condition, args)
+        return cursor.fetchone()[0]
+
+    def check_modified(self, req, pid, *extra):
+        """Send `304 Not Modified` and stop processing `req` if the client
+        already has the response for the current state of project `pid`
+        (or list of projects).
+
+        The validator combines the version of the projects (see
+        `get_version`), their milestones, the request path and arguments,
+        current date, plugin options and `extra` values.
+        """
+        pids = isinstance(pid, (list, tuple)) and list(pid) or [pid]
+        db = self.env.get_read_db()
+        changetime, count, generation = self.get_version(pids)
+        milestones = [(m.name, m.due, m.completed, m.description)
+                      for id_ in pids
+                      for m in model.Milestone.select(self.env, pid=id_, db=db)]
+        # no Last-Modified header: Trac only compares If-None-Match, and
+        # milestone, component and baseline edits don't change `changetime`
+        req.check_modified(from_utimestamp(changetime or 0),
+                           [pids, count, generation, milestones, date.today(), req.path_info,
+                            str(req.locale), sorted(req.args.items()),
+                            list(self.config.options('ganttcalendar'))] + list(extra))
+
+    def get_version(self, pid):
+        """Return version of scheduled tickets of project `pid` (or list of
+        projects): last ticket change time, ticket count and the generation
+        changed by bulk updates (see `touch`)."""
+        pids = isinstance(pid, (list, tuple)) and list(pid) or [pid]
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT MAX(changetime), COUNT(*),
+                   (SELECT value FROM system WHERE name=%%s)
+            FROM ticket WHERE project_id IN (%s)
+            """ % ','.join(['%s'] * len(pids)), [generation_key] + pids)
+        return tuple(cursor.fetchone())
+
+    def touch(self, db):
+        """Change generation of all schedules after updating them without
+        ticket change time, so that every process reads them again."""
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM system WHERE name=%s", (generation_key,))
+        cursor.execute("INSERT INTO system (name, value) VALUES (%s, %s)",
+                       (generation_key, str(to_utimestamp(datetime.now(utc)))))
+
+    def get_fields(self, pid):
+        """Return `ScheduleFields` of project `pid`. Field definitions are
+        kept until the configuration file is reloaded, which happens when
+        custom fields change."""
+        mtime = getattr(self.config, '_lastmtime', None)
+        self._fields_lock.acquire()
+        try:
+            if mtime != self._fields_mtime:
+                self._fields.clear()
+                self._fields_mtime = mtime
+            fields = self._fields.get(pid)
+        finally:
+            self._fields_lock.release()
+        if fields is None:
+            fields = ScheduleFields(TicketSystem(self.env).get_ticket_fields(pid=pid))
+            self._fields_lock.acquire()
+            try:
+                if mtime == self._fields_mtime:
+                    self._fields[pid] = fields
+            finally:
+                self._fields_lock.release()
+        return fields
+
+    def invalidate(self, pid=None):
+        """Drop cached schedules of project `pid` (of all projects by default)."""
+        if pid is None:
+            self._cache.discard()
+        else:
+            self._cache.discard(lambda key: key[0] == pid)
+
+    def _fetch(self, pid, first, last, owner, show_closed, milestone, component, order,
+               description, timer=null_timer):
+        fields = self.get_fields(pid)
+        with timer.phase('query'):
+            rows = self._select(pid, first, last, owner, show_closed, milestone, component,
+                                order, description)
+            if timer.enabled:
+                rows = rows.fetchall()
+        with timer.phase('rows'):
+            return self._build(rows, fields)
+
+    def _select(self, pid, first, last, owner, show_closed, milestone, component, order,
+                description):
+        """Execute schedule query and return the cursor."""
+        condition, args = self._where(pid, first, last, owner, show_closed, milestone,
+                                      component)
+
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+
+        order_by = 'ORDER BY s.due_assign, s.ticket'
+        if order:
+            order_by = 'ORDER BY t.%s, s.due_assign, s.ticket' % db.quote(order)
+
+        sql = '''
+            SELECT id, type, summary, owner, %s, status, resolution, priority,
+                   s.due_assign, s.due_close,
+                   s.complete, s.estimatedhours, s.totalhours, milestone, component,
+                   t.changetime
+            FROM ganttcalendar_schedule s
+            JOIN ticket t ON t.id = s.ticket
+            %s
+            %s
+            ''' % (description and 't.description' or 'NULL', condition, order_by)
+
+        self.log.debug(sql)
+        cursor.execute(sql, args)
+        return cursor
+
+    def _where(self, pid, first, last, owner, show_closed, milestone, component):
+        conditions = []
+        args = []
+
+        conditions.append('s.project_id = %s')
+        args.append(pid)
+
+        conditions.append('s.due_assign <= %s AND s.due_close >= %s')
+        args.extend((self.date_arg(last), self.date_arg(first)))
+
+        if owner:
+            conditions.append('owner=%s')
+            args.append(owner)
+        if not show_closed:
+            conditions.append("status <> 'closed'")
+        if milestone:
+            conditions.append('milestone=%s')
+            args.append(milestone)
+        if component:
+            conditions.append('component=%s')
+            args.append(component)
+
+        return "WHERE " + ' AND '.join(conditions), args
+
+    def date_arg(self, value):
+        """Return `date` as query parameter of `ganttcalendar_schedule`
+        date columns.
+
+        SQLite has no date type and stores dates as ISO strings, which are
+        compared as text; other backends bind native dates.
+        """
+        if self.dialect == 'sqlite':
+            return value.isoformat()
+        return value
+
+    def _build(self, rows, fields):
+        """Convert schedule query rows to `(tickets, sum_estimatedhours,
+        sum_totalhours)`."""
+        tickets = list(self._iter_tickets(rows, fields))
+        sum_estimatedhours = None
+        sum_totalhours = 0.0
+        if fields.time_tracking:
+            sum_estimatedhours = sum((t['estimatedhours'] for t in tickets), 0.0)
+            sum_totalhours = sum((t['totalhours'] for t in tickets), 0.0)
+        return tickets, sum_estimatedhours, sum_totalhours
+
+    def _iter_tickets(self, rows, fields):
+        sqlite = self.dialect == 'sqlite'
+        time_tracking = fields.time_tracking
+        to_complete = fields.to_complete
+        to_estimatedhours = fields.to_estimatedhours
+        to_totalhours = fields.to_totalhours
+        for id_, type_, summary, owner, description, status, resolution, priority, due_assign, due_close, complete, estimatedhours, totalhours, milestone, component, changetime in rows:
+            if sqlite:
+                due_assign = to_date(due_assign)
+                due_close  = to_date(due_close)
+            if not due_assign or not due_close or due_assign > due_close:
+                continue
+            complete = to_complete(complete, 0)
+
+            # time tracking
+            if time_tracking:
+                estimatedhours = to_estimatedhours(estimatedhours, 0.0)
+                totalhours = to_totalhours(totalhours, 0.0)
+
+            yield ScheduleRow(id_, type_, summary, owner, description, status, resolution,
+                              priority, due_assign, due_close, complete, estimatedhours,
+                              totalhours, milestone, component, changetime)
+
+    # ITicketChangeListener
+
+    def ticket_created(self, ticket):
+        self.invalidate(ticket.pid)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate(ticket.pid)
+
+    def ticket_deleted(self, ticket):
+        self.invalidate(ticket.pid)
+
+    # IMilestoneChangeListener
+
+    def milestone_created(self, milestone):
+        self.invalidate(getattr(milestone, 'pid', None))
+
+    def milestone_changed(self, milestone, old_values):
+        self.invalidate(getattr(milestone, 'pid', None))
+
+    def milestone_deleted(self, milestone):
+        self.invalidate(getattr(milestone, 'pid', None))
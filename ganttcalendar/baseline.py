@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+from trac.core import Component, implements, TracError
+from trac.admin import IAdminCommandProvider, AdminCommandError
+from trac.util.datefmt import format_datetime, from_utimestamp, to_utimestamp, utc
+from trac.util.text import print_table
+
+from ganttcalendar.api import to_date, _
+
+
+__all__ = ['GanttBaselines']
+
+
+def slip_days(workdays, planned, current):
+    """Return working days `current` finish date is later than `planned`,
+    negative if it is earlier."""
+    if current >= planned:
+        return workdays.working_days(planned + timedelta(1), current)
+    return -workdays.working_days(current + timedelta(1), planned)
+
+
+class GanttBaselines(Component):
+    """Named snapshots of the dates and progress of project tickets, to
+    compare the current schedule against an approved plan."""
+
+    implements(IAdminCommandProvider)
+
+    def get_baselines(self, pid):
+        """Return baselines of project `pid` as dicts, newest first."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT id, name, author, time FROM ganttcalendar_baseline
+            WHERE project_id=%s ORDER BY time DESC, id DESC
+            """, (pid,))
+        return [{'id': id_, 'name': name, 'author': author, 'time': from_utimestamp(time)}
+                for id_, name, author, time in cursor]
+
+    def create_baseline(self, db, pid, name, author):
+        """Save current schedule of project `pid` as baseline `name` and
+        return its id. Tickets are copied by a single statement."""
+        name = (name or '').strip()
+        if not name:
+            raise TracError(_('Baseline name must not be empty.'))
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM ganttcalendar_baseline WHERE project_id=%s AND name=%s",
+                       (pid, name))
+        if cursor.fetchone():
+            raise TracError(_('Baseline %(name)s already exists.', name=name))
+        cursor.execute("""
+            INSERT INTO ganttcalendar_baseline (project_id, name, author, time)
+            VALUES (%s, %s, %s, %s)
+            """, (pid, name, author, to_utimestamp(datetime.now(utc))))
+        id_ = db.get_last_id(cursor, 'ganttcalendar_baseline')
+        cursor.execute("""
+            INSERT INTO ganttcalendar_baseline_ticket
+                (baseline, ticket, due_assign, due_close, complete)
+            SELECT %s, ticket, due_assign, due_close, complete
+            FROM ganttcalendar_schedule WHERE project_id=%s
+            """, (id_, pid))
+        return id_
+
+    def delete_baseline(self, db, pid, name):
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM ganttcalendar_baseline WHERE project_id=%s AND name=%s",
+                       (pid, name))
+        row = cursor.fetchone()
+        if not row:
+            raise TracError(_('Baseline %(name)s does not exist.', name=name))
+        cursor.execute("DELETE FROM ganttcalendar_baseline_ticket WHERE baseline=%s", row)
+        cursor.execute("DELETE FROM ganttcalendar_baseline WHERE id=%s", row)
+
+    def get_variance(self, pid, baseline_id, workdays):
+        """Compare schedule of project `pid` with its baseline `baseline_id`.
+
+        Returns `(tickets, milestones)`: `tickets` maps ticket id to a dict
+        with baseline `due_assign`, `due_close` and `complete` and the `slip`
+        of its close date, `milestones` maps milestone name to the slip of
+        its latest ticket. Slips are in working days of `workdays` and
+        come from one join of the baseline with the schedule table.
+        Tickets added after the baseline was saved have no slip.
+        """
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT b.ticket, b.due_assign, b.due_close, b.complete, s.due_close, t.milestone
+            FROM ganttcalendar_baseline_ticket b
+            JOIN ganttcalendar_baseline bl ON bl.id = b.baseline
+            JOIN ticket t ON t.id = b.ticket
+            LEFT OUTER JOIN ganttcalendar_schedule s ON s.ticket = b.ticket
+            WHERE b.baseline=%s AND bl.project_id=%s
+            """, (baseline_id, pid))
+        tickets = {}
+        finish = {}
+        for id_, due_assign, due_close, complete, current, milestone in cursor:
+            due_assign, due_close, current = to_date(due_assign), to_date(due_close), \
+                                             to_date(current)
+            plan = {'due_assign': due_assign, 'due_close': due_close,
+                    'complete': complete, 'slip': None}
+            if due_close and current:
+                plan['slip'] = slip_days(workdays, due_close, current)
+                if milestone:
+                    planned, latest = finish.get(milestone, (due_close, current))
+                    finish[milestone] = (max(planned, due_close), max(latest, current))
+            tickets[id_] = plan
+        milestones = dict((name, slip_days(workdays, planned, latest))
+                          for name, (planned, latest) in finish.iteritems())
+        return tickets, milestones
+
+    # IAdminCommandProvider
+
+    def get_admin_commands(self):
+        yield ('ganttcalendar baseline list', '<project>',
+               'List schedule baselines of a project',
+               None, self._do_list)
+        yield ('ganttcalendar baseline add', '<project> <name>',
+               'Save current schedule of a project as a baseline',
+               None, self._do_add)
+        yield ('ganttcalendar baseline remove', '<project> <name>',
+               'Remove a schedule baseline',
+               None, self._do_remove)
+
+    def _do_list(self, pid):
+        print_table([(b['name'], b['author'], format_datetime(b['time']))
+                     for b in self.get_baselines(self._project(pid))],
+                    ['Name', 'Author', 'Time'])
+
+    def _do_add(self, pid, name):
+        pid = self._project(pid)
+        @self.env.with_transaction()
+        def do_add(db):
+            self.create_baseline(db, pid, name, 'admin')
+
+    def _do_remove(self, pid, name):
+        pid = self._project(pid)
+        @self.env.with_transaction()
+        def do_remove(db):
+            self.delete_baseline(db, pid, name)
+
+    def _project(self, pid):
+        try:
+            return int(pid)
+        except ValueError:
+            raise AdminCommandError('Invalid project id %s' % pid)
@@ -2,7 +2,14 @@ import datetime
 
 from trac.core import Component, implements
 from trac.config import ListOption
+from trac.admin import IAdminCommandProvider, AdminCommandError
 from trac.ticket import ITicketChangeListener
+from trac.util.datefmt import to_utimestamp, utc
+from trac.util.text import printout
+
+from trac.project.api import ProjectManagement
+
+from ganttcalendar.api import TracGanttCalendar, ScheduleQuery
 
 
 __all__ = ['GanttCompleteTicketObserver']
@@ -11,11 +18,14 @@ __all__ = ['GanttCompleteTicketObserver']
 
 class GanttCompleteTicketObserver(Component):
 
-    implements(ITicketChangeListener)
+    implements(ITicketChangeListener, IAdminCommandProvider)
 
     complete_conditions = ListOption('ganttcalendar', 'complete_conditions', 'done, fixed, invalid',
         doc='The resolutions to change the ticket progress to 100% when ticket closed', switcher=True)
 
+    # number of tickets updated by one statement
+    batch_size = 500
+
     def ticket_created(self, ticket):
         """Called when a ticket is created."""
         self.watch_complete(ticket, {})
@@ -33,21 +43,106 @@ class GanttCompleteTicketObserver(Component):
         pass
 
     def watch_complete(self, ticket, old_values):
+        # complete by close
+        if self.completes(ticket, old_values):
+            ticket['complete'] = 100
+
+    def completes(self, ticket, old_values):
+        """Return whether the change of `old_values` closes `ticket` with
+        one of `complete_conditions`, setting its progress to 100%."""
         complete = ticket['complete']
         if complete is None or complete == 100:
-            return;
+            return False
 
         oldstatus  = old_values.get('status')
         status     = ticket['status']
         resolution = ticket['resolution']
 
         if not oldstatus or status != 'closed':
-            return
+            return False
 
-        syllabus_id = ticket.syllabus_id
-        complete_conditions = self.complete_conditions.syllabus(syllabus_id)
+        complete_conditions = TracGanttCalendar(self.env).syllabus_option(
+            self, 'complete_conditions', ticket.syllabus_id)
+        return resolution in complete_conditions
 
-        # complete by close
-        if resolution in complete_conditions:
-            ticket['complete'] = 100
 
+    # IAdminCommandProvider
+
+    def get_admin_commands(self):
+        yield ('ganttcalendar complete-closed', '[--dry-run]',
+               """Set progress of closed tickets to 100%
+
+               Applies `complete_conditions` to tickets closed before the
+               plugin was installed or the conditions were changed.""",
+               None, self._do_complete_closed)
+
+    def _do_complete_closed(self, dry_run=None):
+        if dry_run not in (None, '--dry-run'):
+            raise AdminCommandError('Invalid argument %s' % dry_run)
+        @self.env.with_transaction()
+        def do_complete(db):
+            ids = self.complete_closed(db, dry_run is None)
+            printout('%d closed tickets %s.' % (len(ids),
+                     dry_run and 'to be completed' or 'completed'))
+
+    #
+
+    def complete_closed(self, db, update=True):
+        """Set `complete` to 100 of closed tickets whose resolution is in
+        `complete_conditions` of their syllabus. Return ids of the tickets.
+
+        Conditions are resolved once per syllabus and tickets are updated
+        in batches, recording the change in ticket history. Tickets without
+        a `complete` value, e.g. imported ones, get one if their project
+        defines the field.
+        """
+        pm = ProjectManagement(self.env)
+        tgc = TracGanttCalendar(self.env)
+        schedule = ScheduleQuery(self.env)
+        cursor = db.cursor()
+        cursor.execute("SELECT DISTINCT project_id FROM ticket WHERE status='closed'")
+        syllabuses = {}
+        for pid, in cursor.fetchall():
+            if schedule.get_fields(pid).complete is not None:
+                syllabuses.setdefault(pm.get_project_syllabus(pid), []).append(pid)
+
+        changes = []
+        for syllabus_id, pids in syllabuses.iteritems():
+            resolutions = tgc.syllabus_option(self, 'complete_conditions', syllabus_id)
+            if not resolutions:
+                continue
+            cursor.execute("""
+                SELECT t.id, c.ticket, c.value FROM ticket t
+                LEFT OUTER JOIN ticket_custom c ON c.ticket = t.id AND c.name = 'complete'
+                WHERE t.status = 'closed' AND t.project_id IN (%s) AND t.resolution IN (%s)
+                """ % (','.join(['%s'] * len(pids)), ','.join(['%s'] * len(resolutions))),
+                list(pids) + list(resolutions))
+            for id_, custom, value in cursor.fetchall():
+                try:
+                    if float(value) >= 100:
+                        continue
+                except (TypeError, ValueError):
+                    pass
+                changes.append((id_, custom is not None, value or ''))
+        ids = [id_ for id_, exists, value in changes]
+        if not changes or not update:
+            return ids
+
+        when = to_utimestamp(datetime.datetime.now(utc))
+        cursor.executemany("""
+            INSERT INTO ticket_change (ticket, time, author, field, oldvalue, newvalue)
+            VALUES (%s, %s, 'ganttcalendar', 'complete', %s, '100')
+            """, [(id_, when, value) for id_, exists, value in changes])
+        cursor.executemany("""
+            INSERT INTO ticket_custom (ticket, name, value) VALUES (%s, 'complete', '100')
+            """, [(id_,) for id_, exists, value in changes if not exists])
+        for i in xrange(0, len(ids), self.batch_size):
+            batch = ids[i:i + self.batch_size]
+            holders = ','.join(['%s'] * len(batch))
+            cursor.execute("UPDATE ticket_custom SET value='100' "
+                           "WHERE name='complete' AND ticket IN (%s)" % holders, batch)
+            cursor.execute("UPDATE ganttcalendar_schedule SET complete=100 "
+                           "WHERE ticket IN (%s)" % holders, batch)
+            cursor.execute("UPDATE ticket SET changetime=%%s WHERE id IN (%s)" % holders,
+                           [when] + batch)
+        return ids
@@ -0,0 +1,203 @@
+import re
+from collections import deque
+from datetime import date
+from threading import RLock
+
+from trac.core import Component, implements
+from trac.config import Option
+from trac.ticket.api import ITicketChangeListener
+
+from ganttcalendar.api import ScheduleQuery, to_date
+from ganttcalendar.workcalendar import WorkingCalendar
+
+
+__all__ = ['CriticalPath']
+
+
+class ProjectSchedule(object):
+    """Dependency-aware schedule of project tickets.
+
+    `tickets` maps ticket id to a dict with earliest and latest start and
+    finish (`es`, `ef`, `ls`, `lf`, finish dates are inclusive), `slack` in
+    working days and `critical` flag. Tickets in or behind dependency cycles are
+    not scheduled, ids of tickets forming cycles are in `cycle`.
+    """
+
+    def __init__(self, tickets, cycle, workdays=None):
+        self.tickets = tickets
+        self.cycle = cycle
+        self.workdays = workdays
+        self.version = None
+
+
+def compute_schedule(tasks, links, workdays=None):
+    """Compute critical path of `tasks` in time linear to the number of
+    tasks and links.
+
+    `tasks` maps ticket id to `(start, finish)` dates of its plan, which is
+    the earliest a ticket can start. `links` is a list of
+    `(predecessor, successor)` ticket id pairs. Slack is counted in
+    working days of `WorkDays` `workdays`, in calendar days without it.
+    """
+    succ = dict((id_, []) for id_ in tasks)
+    indegree = dict((id_, 0) for id_ in tasks)
+    for pred, id_ in links:
+        if pred in tasks and id_ in tasks and pred != id_:
+            succ[pred].append(id_)
+            indegree[id_] += 1
+
+    # topological order (Kahn)
+    queue = deque(id_ for id_, degree in indegree.iteritems() if not degree)
+    order = []
+    remaining = dict(indegree)
+    while queue:
+        id_ = queue.popleft()
+        order.append(id_)
+        for next_ in succ[id_]:
+            remaining[next_] -= 1
+            if not remaining[next_]:
+                queue.append(next_)
+
+    cycle = []
+    if len(order) < len(tasks):
+        cycle = _cycle_members(succ, set(tasks) - set(order))
+
+    # forward pass, in day ordinals with exclusive finish
+    duration = {}
+    es = {}
+    ef = {}
+    for id_ in order:
+        start, finish = tasks[id_]
+        duration[id_] = (finish - start).days + 1
+        es[id_] = max(es.get(id_, 0), start.toordinal())
+        ef[id_] = es[id_] + duration[id_]
+        for next_ in succ[id_]:
+            es[next_] = max(es.get(next_, 0), ef[id_])
+
+    # backward pass
+    end = ef and max(ef.itervalues()) or 0
+    ls = {}
+    lf = {}
+    for id_ in reversed(order):
+        lf[id_] = min([ls[next_] for next_ in succ[id_] if next_ in ls] or [end])
+        ls[id_] = lf[id_] - duration[id_]
+
+    tickets = {}
+    for id_ in order:
+        slack = ls[id_] - es[id_]
+        if slack and workdays:
+            slack = workdays.working_days(date.fromordinal(es[id_]),
+                                          date.fromordinal(ls[id_] - 1))
+        tickets[id_] = {
+            'es': date.fromordinal(es[id_]), 'ef': date.fromordinal(ef[id_] - 1),
+            'ls': date.fromordinal(ls[id_]), 'lf': date.fromordinal(lf[id_] - 1),
+            'slack': slack, 'critical': slack == 0,
+        }
+    return ProjectSchedule(tickets, cycle, workdays)
+
+def _cycle_members(succ, unsorted):
+    """Return ids of `unsorted` tickets lying on dependency cycles, trimming
+    tickets which only follow cycles."""
+    pred = dict((id_, []) for id_ in unsorted)
+    outdegree = dict((id_, 0) for id_ in unsorted)
+    for id_ in unsorted:
+        for next_ in succ[id_]:
+            if next_ in unsorted:
+                pred[next_].append(id_)
+                outdegree[id_] += 1
+    queue = deque(id_ for id_, degree in outdegree.iteritems() if not degree)
+    members = set(unsorted)
+    while queue:
+        id_ = queue.popleft()
+        members.discard(id_)
+        for prev in pred[id_]:
+            outdegree[prev] -= 1
+            if not outdegree[prev]:
+                queue.append(prev)
+    return sorted(members)
+
+
+class CriticalPath(Component):
+    """Critical path and slack of project tickets, computed from dependency
+    links stored in a ticket custom field."""
+
+    implements(ITicketChangeListener)
+
+    dependency_field = Option('ganttcalendar', 'dependency_field', 'blockedby',
+            doc='Ticket custom field with ids of tickets the ticket depends on, '
+                'e.g. `blockedby`. Empty value disables critical path.')
+
+    _ids_re = re.compile(r'\d+')
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = RLock()
+
+    def get_schedule(self, pid):
+        """Return `ProjectSchedule` of project `pid` or `None` if the
+        dependency field is not defined in the project."""
+        field = self.dependency_field
+        if not field or field not in ScheduleQuery(self.env).get_fields(pid).names:
+            return None
+        workdays = WorkingCalendar(self.env).get_workdays(pid)
+        version = ScheduleQuery(self.env).get_version(pid)
+        self._lock.acquire()
+        try:
+            schedule = self._cache.get(pid)
+        finally:
+            self._lock.release()
+        if schedule is None or schedule.workdays is not workdays or \
+                schedule.version != version:
+            tasks, links = self._load(pid)
+            schedule = compute_schedule(tasks, links, workdays)
+            schedule.version = version
+            self._lock.acquire()
+            try:
+                self._cache[pid] = schedule
+            finally:
+                self._lock.release()
+        return schedule
+
+    def invalidate(self, pid=None):
+        self._lock.acquire()
+        try:
+            if pid is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(pid, None)
+        finally:
+            self._lock.release()
+
+    # ITicketChangeListener
+
+    def ticket_created(self, ticket):
+        self.invalidate(ticket.pid)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate(ticket.pid)
+
+    def ticket_deleted(self, ticket):
+        self.invalidate(ticket.pid)
+
+    #
+
+    def _load(self, pid):
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute('''
+            SELECT s.ticket, s.due_assign, s.due_close, c.value
+            FROM ganttcalendar_schedule s
+            LEFT OUTER JOIN ticket_custom c ON c.ticket = s.ticket AND c.name = %s
+            WHERE s.project_id = %s
+            ''', (self.dependency_field, pid))
+        tasks = {}
+        links = []
+        for id_, due_assign, due_close, depends in cursor:
+            due_assign = to_date(due_assign)
+            due_close = to_date(due_close)
+            if not due_assign or not due_close or due_assign > due_close:
+                continue
+            tasks[id_] = (due_assign, due_close)
+            if depends:
+                links.extend((int(pred), id_) for pred in self._ids_re.findall(depends))
+        return tasks, links
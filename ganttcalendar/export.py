@@ -0,0 +1,169 @@
+from datetime import timedelta
+from xml.sax.saxutils import escape
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+
+__all__ = ['GanttSvgWriter', 'svg_to_png']
+
+
+style = '''
+text { font-family: sans-serif; font-size: 10px; }
+.hdr { fill: #eee; stroke: gray; stroke-width: 1; }
+.grid { stroke: gray; stroke-width: 1; }
+.stripe { fill: #e8f0f8; }
+.weekend { fill: #eee; }
+.done { fill: lightgreen; stroke: green; }
+.late { fill: pink; stroke: red; }
+.todo { fill: lightgrey; stroke: gray; }
+.critical { stroke: #c00; stroke-width: 2; }
+.slack { stroke: #c60; stroke-width: 2; stroke-dasharray: 2,2; }
+.milestone { fill: red; }
+.baseline { stroke: red; stroke-width: 2; stroke-dasharray: 4,2; }
+.closed { text-decoration: line-through; }
+'''
+
+
+def svg_to_png(svg):
+    """Rasterize `svg` string, `None` if cairosvg is not installed."""
+    if cairosvg is None:
+        return None
+    return cairosvg.svg2png(bytestring=svg)
+
+
+class GanttSvgWriter(object):
+    """Write gantt chart as SVG, one element per grid cell, label and bar
+    segment. Markup is generated row by row from ticket geometry computed
+    by `TicketGanttChart.set_geometry`, so rows can be streamed. Days are
+    labeled with `weekdays`, Monday first.
+    """
+
+    label_width = 380   # group and ticket label columns
+    group_width = 90
+
+    def __init__(self, first_date, days_term, baseday, rows, px_dw, px_ti, px_hd, px_ch,
+                 px_top, title='', days_off=(), weekdays=u'MTWTFSS'):
+        self.first_date = first_date
+        self.days_term = days_term
+        self.baseday = baseday
+        self.rows = rows
+        self.px_dw = px_dw
+        self.px_ti = px_ti
+        self.px_hd = px_hd
+        self.px_ch = px_ch
+        self.px_top = px_top
+        self.title = title
+        self.days_off = days_off
+        self.weekdays = weekdays
+        self.width = self.label_width + days_term * px_dw + 2
+        self.height = px_hd + rows * px_ti + px_top + px_ch + 2
+        self._group = None
+
+    def x(self, day):
+        return self.label_width + day * self.px_dw
+
+    def start(self):
+        """Yield SVG header, chart header and background."""
+        yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+        yield u'<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" ' \
+              u'viewBox="0 0 %d %d">\n' % (self.width, self.height, self.width, self.height)
+        if self.title:
+            yield u'<title>%s</title>\n' % escape(self.title)
+        yield u'<style type="text/css">%s</style>\n' % style
+        yield u'<rect x="0" y="0" width="%d" height="%d" fill="#fff"/>\n' % (self.width,
+                                                                             self.height)
+        for markup in self._header():
+            yield markup
+        body_top = self.px_hd
+        body_height = self.height - self.px_hd
+        # weekends and holidays
+        if self.px_dw >= 2:
+            for day in self.days_off:
+                yield u'<rect class="weekend" x="%d" y="%d" width="%d" height="%d"/>\n' % (
+                      self.x(day), body_top, self.px_dw, body_height)
+        # baseline
+        base = (self.baseday - self.first_date).days + 1
+        if 0 <= base <= self.days_term:
+            yield u'<line class="baseline" x1="%d" y1="%d" x2="%d" y2="%d"/>\n' % (
+                  self.x(base), body_top, self.x(base), self.height)
+
+    def _header(self):
+        px_hd, px_dw = self.px_hd, self.px_dw
+        cell = (px_hd - 4) / 3
+        yield u'<rect class="hdr" x="0" y="0" width="%d" height="%d"/>\n' % (self.width, px_hd)
+        yield u'<text x="4" y="%d">%s</text>\n' % (px_hd - 6, escape(self.title))
+        # months
+        day = 0
+        while day < self.days_term:
+            d = self.first_date + timedelta(day)
+            length = min(self._month_days(d) - d.day + 1, self.days_term - day)
+            yield u'<line class="grid" x1="%d" y1="0" x2="%d" y2="%d"/>\n' % (
+                  self.x(day), self.x(day), px_hd)
+            if length * px_dw >= 40:
+                yield u'<text x="%d" y="%d">%04d-%02d</text>\n' % (self.x(day) + 3, cell,
+                                                                  d.year, d.month)
+            day += length
+        # days
+        if px_dw >= 12:
+            wday = self.first_date.weekday()
+            for day in range(self.days_term):
+                d = self.first_date + timedelta(day)
+                yield u'<text x="%d" y="%d">%d</text>\n' % (self.x(day) + 2, cell * 2 + 2, d.day)
+                yield u'<text x="%d" y="%d">%s</text>\n' % (self.x(day) + 2, cell * 3 + 2,
+                                                           escape(self.weekdays[(wday + day) % 7]))
+
+    def _month_days(self, d):
+        next_month = (d.replace(day=28) + timedelta(4)).replace(day=1)
+        return (next_month - timedelta(1)).day
+
+    def row(self, cnt, ticket, group):
+        """Yield elements of row `cnt` showing `ticket`. `group` label is only
+        written when it differs from the previous row."""
+        px_ti, px_ch = self.px_ti, self.px_ch
+        top = px_ti * cnt + self.px_hd + self.px_top
+        if cnt % 2:
+            yield u'<rect class="stripe" x="0" y="%d" width="%d" height="%d"/>\n' % (
+                  top, self.label_width, px_ti)
+        if group != self._group:
+            self._group = group
+            yield u'<text x="3" y="%d">%s</text>\n' % (top + px_ti / 2 + 4,
+                                                      escape(unicode(group)[:16]))
+        summary = ticket['summary']
+        if len(summary) > 40:
+            summary = summary[:40] + u'...'
+        yield u'<text x="%d" y="%d"%s>%s #%d: %s</text>\n' % (
+              self.group_width + 3, top + px_ti / 2 + 4,
+              ticket['status'] == 'closed' and u' class="closed"' or u'',
+              escape(ticket['type'] or u''), ticket['id'], escape(summary))
+
+        bar_top = top + (px_ti - px_ch) / 2
+        critical = ticket.get('critical') and u' critical' or u''
+        tip = escape(u'%s #%d: %s (%s ~ %s)' % (ticket['type'], ticket['id'],
+                                              ticket['summary'], ticket['due_assign'],
+                                              ticket['due_close']))
+        for kind in ('done', 'late', 'todo'):
+            start = ticket.get(kind + '_start')
+            end = ticket.get(kind + '_end')
+            if start is None or end is None or end - start <= 0:
+                continue
+            yield u'<rect class="%s%s" x="%.1f" y="%d" width="%.1f" height="%d">' \
+                  u'<title>%s</title></rect>\n' % (
+                  kind, critical, self.x(start), bar_top, (end - start) * self.px_dw, px_ch, tip)
+        if ticket.get('slack_start') is not None:
+            y = bar_top + px_ch / 2
+            yield u'<line class="slack" x1="%.1f" y1="%d" x2="%.1f" y2="%d"/>\n' % (
+                  self.x(ticket['slack_start']), y, self.x(ticket['slack_end']), y)
+        due = ticket.get('milestone_due')
+        if due is not None:
+            day = (due - self.first_date).days + 1
+            if 0 <= day <= self.days_term:
+                yield u'<rect class="milestone" x="%d" y="%d" width="3" height="%d"/>\n' % (
+                      self.x(day), top, px_ti)
+
+    def end(self):
+        yield u'<line class="grid" x1="%d" y1="0" x2="%d" y2="%d"/>\n' % (
+              self.label_width, self.label_width, self.height)
+        yield u'</svg>\n'
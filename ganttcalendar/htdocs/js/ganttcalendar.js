@@ -0,0 +1,258 @@
+(function($) {
+
+  // Ticket descriptions of popups are loaded on first hover and cached
+  // by URL, so a ticket shown several times is only fetched once.
+  var descriptions = {};
+  var pending = {};
+
+  function loadDescription(url, callback) {
+    if (url in descriptions)
+      return callback(descriptions[url]);
+    if (url in pending)
+      return pending[url].push(callback);
+    pending[url] = [callback];
+    $.ajax({
+      url: url,
+      dataType: 'html',
+      success: function(html) {
+        descriptions[url] = html;
+        $.each(pending[url], function(i, cb) { cb(html); });
+      },
+      complete: function() {
+        delete pending[url];
+      }
+    });
+  }
+
+  // Bars of a ticket changed by someone else are redrawn from geometry
+  // sent by the server, like gantt.html draws them. Changes the page
+  // cannot apply to a single row show the reload notice, as do changes
+  // without ticket id.
+  function patchRow(t, box) {
+    var px_dw = parseFloat(box.attr('data-px-dw'));
+    var px_ch = parseInt(box.attr('data-px-ch'), 10);
+    var href = box.attr('data-ticket-href') + '/' + t.id;
+    var bars = $('[data-ticket="' + t.id + '"]');
+    if (!bars.length)
+      // a new row is needed unless the ticket stays out of the chart
+      return t.all_start == null;
+    var first = bars.first();
+    var top = parseInt(first.is('span') ? first.attr('data-top') : first.css('top'), 10);
+    var anchor = $('<span/>').attr({'data-ticket': t.id, 'data-top': top})
+                             .insertBefore(first);
+    bars.remove();
+    var drawn = false;
+    if (t.all_start != null) {
+      $.each(['todo', 'late', 'done'], function(i, kind) {
+        var s = t.all_start, e = t[kind + '_end'];
+        if (e == null || e - s == 0)
+          return;
+        var width = Math.floor((e - s) * px_dw);
+        $('<div/>').addClass('tic_' + kind + '_bl').attr('data-ticket', t.id)
+          .css({left: Math.floor(s * px_dw + 1), top: top, width: width, height: px_ch})
+          .insertBefore(anchor);
+        $('<div/>').addClass('tic_' + kind + (t.critical ? ' critical' : ''))
+          .attr({'data-ticket': t.id, 'data-due-assign': t.due_assign,
+                 'data-due-close': t.due_close, 'data-changetime': t.changetime,
+                 title: t.tip})
+          .css({left: Math.floor(s * px_dw + 2), top: top + 1,
+                width: Math.max(width - 2, 1), height: px_ch - 2})
+          .click(function() {
+            if (!$('#reschedule .reschedule_mode:checked').length)
+              location.href = href;
+          })
+          .insertBefore(anchor);
+        drawn = true;
+      });
+    }
+    if (drawn)
+      anchor.remove();
+    $('[data-slack="' + t.id + '"]').each(function() {
+      if (t.slack_start == null)
+        return $(this).hide();
+      $(this).show().css({left: Math.floor(t.slack_start * px_dw + 1),
+                          width: Math.floor((t.slack_end - t.slack_start) * px_dw)});
+    });
+    if (t.all_start != null) {
+      $('[data-summary="' + t.id + '"]').css('left', Math.floor(t.all_start * px_dw + 1) + 2);
+      $('[data-status="' + t.id + '"]').css('left', Math.floor(t.all_end * px_dw) + 5)
+        .attr('title', t.tip).find('.tic_complete').text(' ' + t.complete + '%');
+    }
+    return true;
+  }
+
+  function liveUpdates(box) {
+    if (!window.EventSource)
+      return;
+    var source = new EventSource(box.attr('data-href'));
+    source.onmessage = function(event) {
+      var t = $.parseJSON(event.data);
+      if (t.reload ? t.id == null || $('[data-ticket="' + t.id + '"]').length
+                   : !patchRow(t, box))
+        box.show();
+    };
+    source.addEventListener('reset', function() {
+      source.close();
+      box.show();
+    }, false);
+  }
+
+  function addDays(iso, days) {
+    var d = new Date(Date.UTC(+iso.substr(0, 4), +iso.substr(5, 2) - 1,
+                              +iso.substr(8, 2) + days));
+    function pad(n) { return n < 10 ? '0' + n : '' + n; }
+    return d.getUTCFullYear() + '-' + pad(d.getUTCMonth() + 1) + '-' + pad(d.getUTCDate());
+  }
+
+  // Edit mode: bars are moved by dragging them and their close date by
+  // dragging their last pixels, in whole days. Double click sets the
+  // progress. Changes are kept until saved together in one request.
+  function reschedule(box) {
+    var px_dw = parseFloat(box.attr('data-px-dw'));
+    var mode = box.find('.reschedule_mode');
+    var save = box.find('.reschedule_save');
+    var cancel = box.find('.reschedule_cancel');
+    var errors = box.find('.reschedule_errors');
+    var changes = {};
+    var count = 0;
+    var drag = null;
+
+    function bars(id) {
+      return $('div[data-ticket="' + id + '"]');
+    }
+    function change(id) {
+      if (!(id in changes)) {
+        var bar = bars(id).filter('[data-due-assign]').first();
+        changes[id] = {id: +id, assign: bar.attr('data-due-assign'),
+                       close: bar.attr('data-due-close'),
+                       changetime: +bar.attr('data-changetime'), move: 0, resize: 0};
+        count++;
+        save.add(cancel).attr('disabled', false);
+      }
+      return changes[id];
+    }
+
+    mode.change(function() {
+      var editing = this.checked;
+      $('div[data-due-assign]').each(function() {
+        // ticket links of bars are disabled while editing
+        if (editing) {
+          $(this).data('onclick', this.onclick);
+          this.onclick = null;
+        } else if ($(this).data('onclick')) {
+          this.onclick = $(this).data('onclick');
+        }
+      });
+    });
+
+    $('div[data-due-assign]').live('mousedown', function(event) {
+      if (!mode.attr('checked'))
+        return;
+      var id = $(this).attr('data-ticket');
+      var elems = bars(id);
+      var right = 0;
+      elems.each(function() {
+        right = Math.max(right, $(this).offset().left + $(this).outerWidth());
+      });
+      drag = {id: id, x: event.pageX, days: 0, resize: event.pageX >= right - 6,
+              elems: elems.map(function() {
+                var elem = $(this);
+                return {elem: elem, left: parseFloat(elem.css('left')),
+                        width: parseFloat(elem.css('width')),
+                        last: elem.offset().left + elem.outerWidth() >= right - 1};
+              }).get()};
+      event.preventDefault();
+    });
+    $(document).bind('mousemove', function(event) {
+      if (!drag)
+        return;
+      drag.days = Math.round((event.pageX - drag.x) / px_dw);
+      $.each(drag.elems, function(i, e) {
+        if (!drag.resize)
+          e.elem.css('left', e.left + drag.days * px_dw);
+        else if (e.last)
+          e.elem.css('width', Math.max(e.width + drag.days * px_dw, 1));
+      });
+    }).bind('mouseup', function() {
+      if (!drag)
+        return;
+      if (drag.days) {
+        var c = change(drag.id);
+        c[drag.resize ? 'resize' : 'move'] += drag.days;
+        save.val(save.val().replace(/ \(\d+\)$/, '') + ' (' + count + ')');
+      }
+      drag = null;
+    });
+    $('div[data-due-assign]').live('dblclick', function() {
+      if (!mode.attr('checked'))
+        return;
+      var value = prompt(box.attr('data-complete-prompt'), '');
+      if (value !== null && value !== '') {
+        change($(this).attr('data-ticket')).complete = value;
+        save.val(save.val().replace(/ \(\d+\)$/, '') + ' (' + count + ')');
+      }
+    });
+
+    cancel.click(function() {
+      location.reload();
+    });
+    save.click(function() {
+      var list = [];
+      $.each(changes, function(id, c) {
+        var item = {id: c.id, changetime: c.changetime};
+        if (c.move || c.resize) {
+          item.due_assign = addDays(c.assign, c.move);
+          item.due_close = addDays(c.close, c.move + c.resize);
+        }
+        if ('complete' in c)
+          item.complete = c.complete;
+        list.push(item);
+      });
+      save.attr('disabled', true);
+      errors.empty();
+      $.ajax({
+        type: 'POST',
+        url: box.attr('data-href'),
+        data: {__FORM_TOKEN: box.attr('data-token'), changes: JSON.stringify(list)},
+        dataType: 'json',
+        success: function() {
+          location.reload();
+        },
+        error: function(xhr) {
+          save.attr('disabled', false);
+          var result;
+          try {
+            result = $.parseJSON(xhr.responseText);
+          } catch (e) {
+            result = {errors: [{id: null, message: xhr.statusText}]};
+          }
+          $.each(result.errors || [], function(i, error) {
+            $('<li/>').text((error.id ? '#' + error.id + ': ' : '') + error.message)
+                      .appendTo(errors);
+          });
+        }
+      });
+    });
+  }
+
+  $(document).ready(function() {
+    $('#reschedule').each(function() {
+      reschedule($(this));
+    });
+    $('#live_updates').each(function() {
+      liveUpdates($(this));
+    });
+    $('a.tip').mouseenter(function() {
+      $(this).find('div.lazy_description').each(function() {
+        var box = $(this);
+        if (box.data('loaded'))
+          return;
+        box.data('loaded', true);
+        loadDescription(box.attr('data-href'), function(html) {
+          box.html(html);
+        });
+      });
+    });
+  });
+
+})(jQuery);
@@ -0,0 +1,201 @@
+import threading
+import time
+
+from trac.core import Component, implements
+from trac.config import BoolOption, IntOption
+from trac.ticket.api import IMilestoneChangeListener
+from trac.util.presentation import to_json
+from trac.web.api import HTTPNotFound
+
+from ganttcalendar.api import send_stream, to_date, _
+
+
+__all__ = ['ScheduleChangeFeed']
+
+
+class ScheduleChangeFeed(Component):
+    """Recent schedule changes, streamed to open calendar and gantt chart
+    pages as server-sent events.
+
+    Changes are numbered rows of the `ganttcalendar_change` table, recorded
+    by `GanttScheduleStore` in the transaction that stores the schedule of a
+    ticket and by the milestone listener. The numbers are shared by all
+    server processes, so pages pass the number of the latest change they
+    have seen as `since`. Each connection polls the table and is woken up
+    early by changes made through its own process.
+    """
+
+    implements(IMilestoneChangeListener)
+
+    live_updates = BoolOption('ganttcalendar', 'live_updates', 'false',
+            doc='Push schedule changes to open calendar and gantt chart pages. '
+                'Every open page keeps a server connection busy, so the server '
+                'must allow enough concurrent requests.')
+    buffer_size = IntOption('ganttcalendar', 'live_buffer_size', '1000',
+            doc='Number of recent schedule changes kept for live chart updates. '
+                '0 disables live updates.')
+    live_timeout = IntOption('ganttcalendar', 'live_timeout', '25',
+            doc='Seconds a live update connection is kept open before the '
+                'browser reconnects')
+
+    # seconds between checks for changes made by other processes
+    poll_interval = 2
+
+    def __init__(self):
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.live_updates and self.buffer_size > 0
+
+    def last_seq(self):
+        """Return number of the latest change."""
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(seq) FROM ganttcalendar_change")
+        return cursor.fetchone()[0] or 0
+
+    def record(self, db, pid, ticket=None, milestone=None):
+        """Record a change of `ticket` or `milestone` of project `pid` in
+        transaction `db`, dropping changes beyond `live_buffer_size`.
+        Changes of milestones without project are sent to all pages."""
+        if not self.enabled:
+            return
+        cursor = db.cursor()
+        cursor.execute("""
+            INSERT INTO ganttcalendar_change (project_id, ticket, milestone)
+            VALUES (%s, %s, %s)
+            """, (pid, ticket, milestone))
+        seq = db.get_last_id(cursor, 'ganttcalendar_change')
+        cursor.execute("DELETE FROM ganttcalendar_change WHERE seq<=%s",
+                       (seq - self.buffer_size,))
+
+    def notify(self):
+        """Wake up connections of this process after a change is committed."""
+        self._cond.acquire()
+        try:
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def get_changes(self, pids, since):
+        """Return `(seq, changes)` of projects `pids` made after change
+        `since`, up to the latest change `seq`. `changes` is `None` if
+        changes after `since` are no longer kept.
+
+        Ticket changes carry the current ticket and its stored schedule, or
+        `deleted` if the ticket no longer exists.
+        """
+        db = self.env.get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT MIN(seq), MAX(seq) FROM ganttcalendar_change")
+        first, seq = cursor.fetchone()
+        seq = seq or 0
+        if since > seq or first is not None and since < first - 1:
+            return seq, None
+        cursor.execute("""
+            SELECT c.seq, c.project_id, c.ticket, c.milestone, t.id, t.type, t.summary,
+                   t.owner, t.status, t.resolution, t.priority, t.milestone, t.component,
+                   t.changetime, s.due_assign, s.due_close, s.complete,
+                   s.estimatedhours, s.totalhours
+            FROM ganttcalendar_change c
+            LEFT OUTER JOIN ticket t ON t.id = c.ticket
+            LEFT OUTER JOIN ganttcalendar_schedule s ON s.ticket = c.ticket
+            WHERE c.seq > %%s AND c.seq <= %%s
+                  AND (c.project_id IN (%s) OR c.project_id IS NULL)
+            ORDER BY c.seq
+            """ % ','.join(['%s'] * len(pids)), [since, seq] + list(pids))
+        changes = []
+        for row in cursor:
+            change = {'seq': row[0], 'pid': row[1]}
+            if row[2] is None:
+                change['milestone'] = row[3]
+            else:
+                change.update({'ticket': row[2], 'deleted': row[4] is None})
+                for name, value in zip(('type', 'summary', 'owner', 'status', 'resolution',
+                                        'priority', 'milestone', 'component',
+                                        'changetime'), row[5:14]):
+                    change[name] = value
+                # typed like ganttcalendar_schedule columns
+                change.update({'due_assign': to_date(row[14]), 'due_close': to_date(row[15]),
+                               'complete': row[16], 'estimatedhours': row[17],
+                               'totalhours': row[18]})
+            changes.append(change)
+        return seq, changes
+
+    def wait(self, pids, since, timeout):
+        """Return `get_changes(pids, since)`, waiting up to `timeout`
+        seconds for a change."""
+        deadline = time.time() + timeout
+        while True:
+            seq, changes = self.get_changes(pids, since)
+            remaining = deadline - time.time()
+            if changes is None or changes or remaining <= 0:
+                return seq, changes
+            self._cond.acquire()
+            try:
+                self._cond.wait(min(remaining, self.poll_interval))
+            finally:
+                self._cond.release()
+
+    def send_changes(self, req, pids, render):
+        """Stream changes of projects `pids` as server-sent events until
+        `live_timeout` expires. `render(change)` returns event data of a
+        change, or `None` to skip it.
+
+        A `reset` event tells the page that changes were lost and it has to
+        be reloaded.
+        """
+        if not self.enabled:
+            raise HTTPNotFound(_('Live updates are disabled.'))
+        since = req.get_header('Last-Event-ID') or req.args.get('since')
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            since = self.last_seq()
+
+        def events():
+            seq = sent = since
+            deadline = time.time() + self.live_timeout
+            yield 'retry: 3000\n\n'
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                seq, changes = self.wait(pids, seq, remaining)
+                if changes is None:
+                    yield 'event: reset\ndata: {}\n\n'
+                    break
+                for change in changes:
+                    data = render(change)
+                    if data is not None:
+                        sent = change['seq']
+                        yield 'id: %d\ndata: %s\n\n' % (sent, to_json(data))
+                if sent != seq:
+                    # skip changes of other projects on reconnect
+                    sent = seq
+                    yield 'id: %d\n\n' % seq
+
+        req.send_header('Cache-Control', 'no-cache')
+        send_stream(req, events(), 'text/event-stream', chunk_size=0)
+
+    # IMilestoneChangeListener
+
+    def milestone_created(self, milestone):
+        self._add_milestone(milestone)
+
+    def milestone_changed(self, milestone, old_values):
+        self._add_milestone(milestone)
+
+    def milestone_deleted(self, milestone):
+        self._add_milestone(milestone)
+
+    #
+
+    def _add_milestone(self, milestone):
+        if not self.enabled:
+            return
+        @self.env.with_transaction()
+        def do_record(db):
+            self.record(db, getattr(milestone, 'pid', None), milestone=milestone.name)
+        self.notify()
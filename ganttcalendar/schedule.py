@@ -0,0 +1,211 @@
+from trac.core import Component, implements
+from trac.admin import IAdminCommandProvider
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+from trac.ticket import ITicketChangeListener
+from trac.util.text import printout
+
+from ganttcalendar.api import ScheduleQuery, to_date
+from ganttcalendar.complete_by_close import GanttCompleteTicketObserver
+from ganttcalendar.live import ScheduleChangeFeed
+
+
+__all__ = ['GanttScheduleStore']
+
+
+db_version_key = 'ganttcalendar_version'
+db_version = 3
+
+schema = [
+    # Typed copy of the ticket schedule custom fields
+    Table('ganttcalendar_schedule', key='ticket')[
+        Column('ticket', type='int'),
+        Column('project_id', type='int'),
+        Column('due_assign', type='date'),
+        Column('due_close', type='date'),
+        Column('complete', type='int'),
+        Column('estimatedhours', type='real'),
+        Column('totalhours', type='real'),
+        Index(['project_id', 'due_assign', 'due_close']),
+    ],
+    # Named snapshots of project schedules
+    Table('ganttcalendar_baseline', key='id')[
+        Column('id', auto_increment=True),
+        Column('project_id', type='int'),
+        Column('name'),
+        Column('author'),
+        Column('time', type='int64'),
+        Index(['project_id', 'name'], unique=True),
+    ],
+    Table('ganttcalendar_baseline_ticket', key=('baseline', 'ticket'))[
+        Column('baseline', type='int'),
+        Column('ticket', type='int'),
+        Column('due_assign', type='date'),
+        Column('due_close', type='date'),
+        Column('complete', type='int'),
+    ],
+    # Recent schedule changes pushed to open pages
+    Table('ganttcalendar_change', key='seq')[
+        Column('seq', auto_increment=True),
+        Column('project_id', type='int'),
+        Column('ticket', type='int'),
+        Column('milestone'),
+    ],
+]
+
+schedule_columns = ('ticket', 'project_id', 'due_assign', 'due_close',
+                    'complete', 'estimatedhours', 'totalhours')
+
+
+def to_number(value, type_=float):
+    if value is None or value == '':
+        return None
+    try:
+        return type_(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def schedule_row(id_, pid, due_assign, due_close, complete, estimatedhours, totalhours):
+    """Return a typed `ganttcalendar_schedule` row or `None` if the ticket
+    has no schedule."""
+    due_assign = to_date(due_assign)
+    due_close  = to_date(due_close)
+    if not due_assign or not due_close:
+        return None
+    return (id_, pid, due_assign, due_close, to_number(complete, int),
+            to_number(estimatedhours), to_number(totalhours))
+
+
+class GanttScheduleStore(Component):
+    """Keep the `ganttcalendar_schedule` table in sync with tickets and
+    record changed schedules for `ScheduleChangeFeed`."""
+
+    implements(IEnvironmentSetupParticipant, ITicketChangeListener,
+               IAdminCommandProvider)
+
+    # IEnvironmentSetupParticipant
+
+    def environment_created(self):
+        @self.env.with_transaction()
+        def do_create(db):
+            self.upgrade_environment(db)
+
+    def environment_needs_upgrade(self, db):
+        return self._get_version(db) < db_version
+
+    def upgrade_environment(self, db):
+        version = self._get_version(db)
+        cursor = db.cursor()
+        if version < 1:
+            self._create_tables(cursor, ['ganttcalendar_schedule'])
+            self.resync(db)
+        if version < 2:
+            self._create_tables(cursor, ['ganttcalendar_baseline',
+                                         'ganttcalendar_baseline_ticket'])
+        if version < 3:
+            self._create_tables(cursor, ['ganttcalendar_change'])
+        if version:
+            cursor.execute("UPDATE system SET value=%s WHERE name=%s",
+                           (str(db_version), db_version_key))
+        else:
+            cursor.execute("INSERT INTO system (name, value) VALUES (%s, %s)",
+                           (db_version_key, str(db_version)))
+        self.log.info('Upgraded ganttcalendar schema to version %d', db_version)
+
+    def _create_tables(self, cursor, names):
+        connector = DatabaseManager(self.env)._get_connector()[0]
+        for table in schema:
+            if table.name in names:
+                for stmt in connector.to_sql(table):
+                    cursor.execute(stmt)
+
+    def _get_version(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s", (db_version_key,))
+        row = cursor.fetchone()
+        return row and int(row[0]) or 0
+
+    # ITicketChangeListener
+
+    def ticket_created(self, ticket):
+        """Called when a ticket is created."""
+        self._sync_ticket(ticket, {})
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        """Called when a ticket is modified.
+
+        `old_values` is a dictionary containing the previous values of the
+        fields that have changed.
+        """
+        self._sync_ticket(ticket, old_values)
+
+    def ticket_deleted(self, ticket):
+        """Called when a ticket is deleted."""
+        @self.env.with_transaction()
+        def do_delete(db):
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM ganttcalendar_schedule WHERE ticket=%s",
+                           (ticket.id,))
+            ScheduleChangeFeed(self.env).record(db, ticket.pid, ticket.id)
+        ScheduleChangeFeed(self.env).notify()
+
+    def _sync_ticket(self, ticket, old_values):
+        # listeners are called in no particular order, so the progress set
+        # on close is not read back from the ticket
+        complete = GanttCompleteTicketObserver(self.env).completes(ticket, old_values) \
+                   and 100 or ticket['complete']
+        row = schedule_row(ticket.id, ticket.pid,
+                           ticket['due_assign'], ticket['due_close'],
+                           complete, ticket['estimatedhours'],
+                           ticket['totalhours'])
+        @self.env.with_transaction()
+        def do_sync(db):
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM ganttcalendar_schedule WHERE ticket=%s",
+                           (ticket.id,))
+            if row:
+                cursor.execute(self._insert_sql(), self._db_row(row))
+            ScheduleChangeFeed(self.env).record(db, ticket.pid, ticket.id)
+        ScheduleChangeFeed(self.env).notify()
+
+    # IAdminCommandProvider
+
+    def get_admin_commands(self):
+        yield ('ganttcalendar resync', '',
+               'Rebuild the ticket schedule table used by calendar and gantt chart',
+               None, self._do_resync)
+
+    def _do_resync(self):
+        @self.env.with_transaction()
+        def do_resync(db):
+            count = self.resync(db)
+            printout('%d ticket schedules stored.' % count)
+
+    #
+
+    def resync(self, db):
+        """Refill the schedule table from `ticket_custom` values."""
+        cursor = db.cursor()
+        cursor.execute('''
+            SELECT t.id, t.project_id, a.value, c.value,
+                   cmp.value, est.value, tot.value
+            FROM ticket t
+            JOIN ticket_custom a ON a.ticket = t.id AND a.name = 'due_assign'
+            JOIN ticket_custom c ON c.ticket = t.id AND c.name = 'due_close'
+            LEFT OUTER JOIN ticket_custom cmp ON cmp.ticket = t.id AND cmp.name = 'complete'
+            LEFT OUTER JOIN ticket_custom est ON est.ticket = t.id AND est.name = 'estimatedhours'
+            LEFT OUTER JOIN ticket_custom tot ON tot.ticket = t.id AND tot.name = 'totalhours'
+            ''')
+        rows = [self._db_row(r) for r in (schedule_row(*row) for row in cursor) if r]
+        cursor.execute("DELETE FROM ganttcalendar_schedule")
+        cursor.executemany(self._insert_sql(), rows)
+        ScheduleQuery(self.env).touch(db)
+        return len(rows)
+
+    def _db_row(self, row):
+        date_arg = ScheduleQuery(self.env).date_arg
+        return row[:2] + (date_arg(row[2]), date_arg(row[3])) + row[4:]
+
+    def _insert_sql(self):
+        return "INSERT INTO ganttcalendar_schedule (%s) VALUES (%s)" % (
+               ','.join(schedule_columns), ','.join(['%s'] * len(schedule_columns)))
@@ -1,24 +1,50 @@
 import calendar
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
 from genshi.builder import tag
 
-from trac.core import Component, implements
+from trac.core import Component, implements, TracError
+from trac.util.datefmt import parse_date_only, utc
 from trac.web import IRequestHandler
-from trac.web.chrome import INavigationContributor, add_stylesheet
+from trac.web.chrome import INavigationContributor, add_stylesheet, add_script, add_link
 from trac.config import BoolOption
 
-from trac.ticket.api import TicketSystem, convert_field_value
 from trac.ticket import model
 
 from trac.project.api import ProjectManagement
 
-from ganttcalendar.api import TracGanttCalendar, month_tbl, weekdays, date_format, _
+from ganttcalendar.api import TracGanttCalendar, ScheduleQuery, DayBuckets, \
+                               month_tbl, weekdays, date_format, add_months, \
+                               to_columns, send_json, send_stream, _
+from ganttcalendar.live import ScheduleChangeFeed
+from ganttcalendar.workcalendar import WorkingCalendar
 
 
 __all__ = ['TicketCalendar']
 
 
+def ics_escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+                       .replace('\r\n', '\\n').replace('\n', '\\n')
+
+def ics_date(d):
+    return d.strftime('%Y%m%d')
+
+def ics_line(name, value):
+    """Return UTF-8 encoded iCalendar content line, folded to 75 octets."""
+    line = (u'%s:%s' % (name, value)).encode('utf-8')
+    parts = []
+    while len(line) > 75:
+        cut = parts and 74 or 75
+        # do not split multibyte characters
+        while ord(line[cut]) & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return '\r\n '.join(parts) + '\r\n'
+
+
 
 class TicketCalendar(Component):
 
@@ -27,6 +53,11 @@ class TicketCalendar(Component):
     show_weekly_view = BoolOption('ganttcalendar', 'show_weekly_view', 'false',
             doc='Set weekly view as default in calendar.')
 
+    # columns of JSON calendar data
+    ticket_columns = ('id', 'type', 'summary', 'owner', 'status', 'resolution', 'priority',
+                      'due_assign', 'due_close', 'complete', 'estimatedhours', 'totalhours')
+    milestone_columns = ('name', 'due', 'completed')
+
     def __init__(self):
         self.tgc = TracGanttCalendar(self.env)
 
@@ -56,6 +87,19 @@ class TicketCalendar(Component):
     def process_request(self, req):
         req.perm.require('TICKET_VIEW')
 
+        if req.path_info == '/ticketcalendar/description':
+            self.tgc.send_description(req, req.args.getint('id'))
+
+        pid = ProjectManagement(self.env).get_current_project(req)
+        if req.path_info == '/ticketcalendar/changes':
+            # days show several tickets, the page is reloaded on any change
+            ScheduleChangeFeed(self.env).send_changes(req, [pid], lambda change:
+                    {'reload': True})
+        ScheduleQuery(self.env).check_modified(req, pid)
+
+        if req.path_info == '/ticketcalendar/feed.ics':
+            self.send_feed(req, pid)
+
         year  = req.args.getint('year')
         month = req.args.getint('month')
         day   = req.args.getint('day', 1)
@@ -66,11 +110,6 @@ class TicketCalendar(Component):
 
         selected_milestone = req.args.get('selected_milestone')
 
-        pm = ProjectManagement(self.env)
-        pid = pm.get_current_project(req)
-
-        fields = TicketSystem(self.env).get_ticket_fields(pid=pid)
-
         if year and month:
             cday = date(int(year),int(month),int(day))
         else:
@@ -90,132 +129,170 @@ class TicketCalendar(Component):
             prev = cday.replace(day=1).__add__(timedelta(days=-1)).replace(day=1)
             next = cday.replace(day=1).__add__(timedelta(days=32)).replace(day=1)
 
-        conditions = []
-        args = []
-
-        conditions.append('t.project_id = %s')
-        args.append(pid)
-
-        conditions.append("(a.due_assign, c.due_close + INTERVAL '1 DAY')"
-                          " OVERLAPS (DATE '%s', DATE '%s')" % (
-                          first.isoformat(), last.isoformat()))
-
-        if show_my_ticket:
-            conditions.append('owner=%s')
-            args.append(req.authname)
-        if not show_closed_ticket:
-            conditions.append("status <> 'closed'")
-        if selected_milestone:
-            conditions.append('milestone=%s')
-            args.append(selected_milestone)
+        timer = self.tgc.get_timer()
+        schedule = ScheduleQuery(self.env)
+        tickets, total, sum_estimatedhours, sum_totalhours = schedule.get_tickets(
+            pid, first, last, owner=show_my_ticket and req.authname or None,
+            show_closed=bool(show_closed_ticket), milestone=selected_milestone,
+            description=not self.tgc.lazy_description, timer=timer)
 
         db = self.env.get_read_db()
-        cursor = db.cursor();
-
-        condition = "WHERE " + ' AND '.join(conditions)
-
-        sql = '''
-            SELECT id, type, summary, owner, description, status, resolution, priority,
-                   a.due_assign, c.due_close,
-                   cmp.value, est.value, tot.value from ticket t
-            JOIN (
-                SELECT ticket, CAST(value AS DATE) AS due_assign
-                FROM ticket_custom
-                WHERE name = 'due_assign' AND value IS NOT NULL
-            ) a ON a.ticket = t.id
-            JOIN (
-                SELECT ticket, CAST(value AS DATE) AS due_close
-                FROM ticket_custom
-                WHERE name = 'due_close' AND value IS NOT NULL
-            ) c ON c.ticket = t.id
-            JOIN ticket_custom cmp ON cmp.ticket = t.id AND cmp.name = 'complete'
-            LEFT OUTER JOIN ticket_custom est ON est.ticket = t.id AND est.name = 'estimatedhours'
-            LEFT OUTER JOIN ticket_custom tot ON tot.ticket = t.id AND tot.name = 'totalhours'
-            %s
-            ''' % (condition,)
-
-        self.log.debug(sql)
-        cursor.execute(sql, args)
-
-        time_tracking = 'estimatedhours' in fields
-        sum_estimatedhours = 0.0
-        sum_totalhours = 0.0
-
-        tickets=[]
-        for id, type, summary, owner, description, status, resolution, priority, due_assign, due_close, complete, estimatedhours, totalhours in cursor:
-            due_assign_date = due_assign
-            due_close_date  = due_close
-            complete        = convert_field_value(fields.get('complete'), complete, 0)
-
-            if not due_assign_date or not due_close_date or due_assign_date > due_close_date:
-                continue
-
-            # time tracking
-            if time_tracking:
-                estimatedhours = convert_field_value(fields.get('estimatedhours'), estimatedhours, 0.0)
-                totalhours = convert_field_value(fields.get('totalhours'), totalhours, 0.0)
-                sum_estimatedhours += estimatedhours
-                sum_totalhours += totalhours
-
-            ticket = {'id':id, 'type':type, 'summary':summary, 'owner':owner, 'description': description,
-                      'status':status, 'resolution':resolution, 'priority':priority,
-                      'due_assign':due_assign_date, 'due_close':due_close_date, 'complete': complete,
-                      'estimatedhours':estimatedhours, 'totalhours':totalhours}
-            tickets.append(ticket)
-
-        # time tracking
-        if not time_tracking:
-            sum_estimatedhours = None
 
         # milestones
-        milestones = [{}]
-        milestones_list = model.Milestone.select(self.env, pid=pid, db=db)
-        for m in milestones_list:
-            d = m.due
-            if d:
-                d = d.date()
-            milestones.append({
-                'name': m.name,
-                'due': d,
-                'completed': bool(m.completed),
-                'description': m.description,
+        with timer.phase('milestones'):
+            milestones = [{}]
+            milestones_list = model.Milestone.select(self.env, pid=pid, db=db)
+            for m in milestones_list:
+                d = m.due
+                if d:
+                    d = d.date()
+                milestones.append({
+                    'name': m.name,
+                    'due': d,
+                    'completed': bool(m.completed),
+                    'description': m.description,
+                })
+
+        if req.path_info == '/ticketcalendar/data.json':
+            self.tgc.send_timing(req, timer)
+            self.tgc.log_timing(req, timer)
+            send_json(req, {
+                'first': first.isoformat(), 'last': last.isoformat(),
+                'sum_estimatedhours': sum_estimatedhours, 'sum_totalhours': sum_totalhours,
+                'tickets': to_columns(tickets, self.ticket_columns),
+                'milestones': to_columns(milestones[1:], self.milestone_columns),
             })
 
         #days
-        days = {}
-        for d in range((last-first).days+1):
-            mday= first + timedelta(d)
-            days[mday] = {}
-            #day kind
-            if mday == date.today():
-                kind = 'today'
-            elif mday.weekday() in (5,6):
-                kind = 'holiday'
-            else:
-                kind = 'active'
-            days[mday]['kind'] = kind
-            #ticket
-            days[mday]['ticket']=[]
-            for t in range(len(tickets)):
-                if mday == tickets[t]['due_assign'] == tickets[t]['due_close']:
-                    days[mday]['ticket'].append({'img':'bw','num':t})
-                elif mday == tickets[t]['due_assign']:
-                    days[mday]['ticket'].append({'img':'from','num':t})
-                elif mday == tickets[t]['due_close']:
-                    days[mday]['ticket'].append({'img':'to','num':t})
-            #milestone
-            days[mday]['milestone'] = []
-            for m in range(len(milestones)):
-                if mday == milestones[m].get('due'):
-                    days[mday]['milestone'].append(m)
+        with timer.phase('days'):
+            buckets = DayBuckets(first, last)
+            for num, t in enumerate(tickets):
+                buckets.add_ticket(num, t['due_assign'], t['due_close'])
+            for num, m in enumerate(milestones):
+                buckets.add_milestone(num, m.get('due'))
+
+            today = date.today()
+            workdays = WorkingCalendar(self.env).get_workdays(pid)
+            days = {}
+            for mday, day_tickets, day_milestones in buckets.days():
+                #day kind
+                if mday == today:
+                    kind = 'today'
+                elif not workdays.is_working(mday):
+                    kind = 'holiday'
+                else:
+                    kind = 'active'
+                days[mday] = {'kind': kind, 'ticket': day_tickets, 'milestone': day_milestones,
+                              'holiday_desc': workdays.description(mday)}
 
         data = {'current':cday, 'prev':prev, 'next':next, 'weekly':weekly_view, 'first':first, 'last':last,
                 'tickets':tickets, 'milestones':milestones,'days':days,
                 'sum_estimatedhours':sum_estimatedhours, 'sum_totalhours':sum_totalhours,
                 'show_my_ticket': show_my_ticket, 'show_closed_ticket': show_closed_ticket, 'selected_milestone': selected_milestone,
-                '_':_,'date_format':date_format, 'month_tbl': month_tbl, 'weekdays': weekdays}
-
+                'lazy_description': self.tgc.lazy_description,
+                '_':_,'date_format':date_format, 'month_tbl': month_tbl, 'weekdays': weekdays,
+                'request_timer': timer}
+
+        feed_args = dict((k, v) for k, v in req.args.iteritems()
+                         if k in ('show_my_ticket', 'hide_closed_ticket', 'selected_milestone'))
+        add_link(req, 'alternate', req.href.ticketcalendar('feed.ics', **feed_args),
+                 _('iCalendar'), 'text/calendar', 'ics')
+        feed = ScheduleChangeFeed(self.env)
+        data['live_href'] = feed.enabled and \
+                req.href.ticketcalendar('changes', since=feed.last_seq()) or None
         add_stylesheet(req, 'ganttcalendar/css/calendar.css')
+        add_script(req, 'ganttcalendar/js/ganttcalendar.js')
 
+        self.tgc.send_timing(req, timer)
         return 'calendar.html', data, None
 
+    def send_feed(self, req, pid):
+        """Send tickets and milestones of project `pid` as iCalendar feed.
+
+        Tickets are sent as to-dos, or as events if `events` argument is set,
+        for clients that do not show to-dos of subscribed calendars. The
+        feed covers `from`..`to` dates, three months back and a year ahead
+        by default.
+        """
+        today = date.today()
+        first = self._date_arg(req, 'from') or add_months(today.year, today.month, -3)
+        last  = self._date_arg(req, 'to') or add_months(today.year, today.month, 13) - timedelta(1)
+        events = req.args.getbool('events', False)
+
+        selected_milestone = req.args.get('selected_milestone')
+        query = {
+            'owner': req.args.getbool('show_my_ticket', False) and req.authname or None,
+            'show_closed': not req.args.getbool('hide_closed_ticket', False),
+            'milestone': selected_milestone,
+        }
+        milestones = []
+        for m in model.Milestone.select(self.env, pid=pid):
+            if m.due and first <= m.due.date() <= last and \
+                    (not selected_milestone or m.name == selected_milestone):
+                milestones.append(m)
+        name = ProjectManagement(self.env).get_project_info(pid)['name']
+
+        send_stream(req, self._feed(req, pid, first, last, query, events, milestones, name),
+                    'text/calendar;charset=utf-8')
+
+    def _date_arg(self, req, name):
+        value = req.args.get(name)
+        if value:
+            try:
+                return parse_date_only(value)
+            except TracError:
+                pass
+        return None
+
+    def _feed(self, req, pid, first, last, query, events, milestones, name):
+        stamp = datetime.now(utc).strftime('%Y%m%dT%H%M%SZ')
+        day = timedelta(1)
+
+        yield ics_line('BEGIN', 'VCALENDAR')
+        yield ics_line('VERSION', '2.0')
+        yield ics_line('PRODID', '-//TracGanttCalendar//Ticket schedule//EN')
+        yield ics_line('CALSCALE', 'GREGORIAN')
+        yield ics_line('METHOD', 'PUBLISH')
+        yield ics_line('X-WR-CALNAME', ics_escape(name))
+
+        for m in milestones:
+            due = m.due.date()
+            yield ics_line('BEGIN', 'VEVENT')
+            yield ics_line('UID', req.abs_href.milestone(m.name))
+            yield ics_line('DTSTAMP', stamp)
+            yield ics_line('DTSTART;VALUE=DATE', ics_date(due))
+            yield ics_line('DTEND;VALUE=DATE', ics_date(due + day))
+            yield ics_line('SUMMARY', ics_escape('%s: %s' % (_('Milestone'), m.name)))
+            if m.description:
+                yield ics_line('DESCRIPTION', ics_escape(m.description))
+            yield ics_line('URL', req.abs_href.milestone(m.name))
+            yield ics_line('TRANSP', 'TRANSPARENT')
+            yield ics_line('END', 'VEVENT')
+
+        for t in ScheduleQuery(self.env).iter_tickets(pid, first, last, **query):
+            kind = events and 'VEVENT' or 'VTODO'
+            yield ics_line('BEGIN', kind)
+            yield ics_line('UID', req.abs_href.ticket(t['id']))
+            yield ics_line('DTSTAMP', stamp)
+            yield ics_line('DTSTART;VALUE=DATE', ics_date(t['due_assign']))
+            if events:
+                # end dates of events are exclusive
+                yield ics_line('DTEND;VALUE=DATE', ics_date(t['due_close'] + day))
+            else:
+                yield ics_line('DUE;VALUE=DATE', ics_date(t['due_close']))
+            yield ics_line('SUMMARY', ics_escape('%s #%d: %s' % (t['type'], t['id'], t['summary'])))
+            yield ics_line('URL', req.abs_href.ticket(t['id']))
+            if events:
+                yield ics_line('TRANSP', 'TRANSPARENT')
+            else:
+                if t['status'] == 'closed':
+                    status = 'COMPLETED'
+                elif t['status'] == 'new':
+                    status = 'NEEDS-ACTION'
+                else:
+                    status = 'IN-PROCESS'
+                yield ics_line('STATUS', status)
+                yield ics_line('PERCENT-COMPLETE', max(0, min(int(t['complete'] or 0), 100)))
+            yield ics_line('END', kind)
+
+        yield ics_line('END', 'VCALENDAR')
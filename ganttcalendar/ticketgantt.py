@@ -1,21 +1,34 @@
 import calendar
-from datetime import date, timedelta
+import json
+import threading
+from datetime import date, datetime, timedelta
+from Queue import Queue, Empty
 from genshi.builder import tag
+from genshi.core import Markup, escape
 
-from trac.core import Component, implements, TracError
+from trac.core import Component, ExtensionPoint, implements, TracError
 from trac.config import IntOption, BoolOption
-from trac.util.datefmt import parse_date_only
+from trac.util.datefmt import parse_date_only, to_utimestamp, utc
+from trac.util.text import exception_to_unicode
 
 from trac.web import IRequestHandler
-from trac.web.chrome import INavigationContributor, \
-                            add_stylesheet, add_warning
+from trac.web.chrome import INavigationContributor, Chrome, \
+                            add_stylesheet, add_script, add_warning, add_ctxtnav, add_link
 
-from trac.ticket.api import TicketSystem, convert_field_value
-from trac.ticket import model
+from trac.ticket import model, ITicketManipulator
+from trac.ticket.notification import TicketNotifyEmail
+from trac.resource import ResourceNotFound
 
 from trac.project.api import ProjectManagement
 
-from ganttcalendar.api import TracGanttCalendar, month_tbl, add_months, date_format, _
+from ganttcalendar.api import TracGanttCalendar, ScheduleQuery, ScheduleRow, LRUCache, month_tbl, \
+                               add_months, date_format, to_columns, send_json, \
+                               send_stream, to_date, null_timer, _
+from ganttcalendar.baseline import GanttBaselines
+from ganttcalendar.criticalpath import CriticalPath
+from ganttcalendar.export import GanttSvgWriter, svg_to_png
+from ganttcalendar.live import ScheduleChangeFeed
+from ganttcalendar.workcalendar import WorkingCalendar
 
 
 __all__ = ['TicketGanttChart']
@@ -26,16 +39,45 @@ class TicketGanttChart(Component):
 
     implements(INavigationContributor, IRequestHandler)
 
+    ticket_manipulators = ExtensionPoint(ITicketManipulator)
+
     show_ticket_summary = BoolOption('ganttcalendar', 'show_ticket_summary', 'false',
             doc='Show ticket summary at gantchart bar')
     normal_mode = IntOption('ganttcalendar', 'default_zoom_mode', '3',
             doc='Default zoom mode in gantchar')
+    rows_per_page = IntOption('ganttcalendar', 'rows_per_page', '0',
+            doc='Maximum number of tickets shown on one gantchart page. 0 shows all tickets')
+    grid_cache_size = IntOption('ganttcalendar', 'grid_cache_size', '1048576',
+            doc='Memory budget of rendered gantchart headers and grids in bytes. 0 disables cache.')
+    portfolio_threads = IntOption('ganttcalendar', 'portfolio_threads', '4',
+            doc='Number of projects loaded in parallel by multi-project gantchart')
+    range_width = IntOption('ganttcalendar', 'range_width', '1200',
+            doc='Width in pixels of gantchart showing a `from` - `to` date range')
 
     # zoom mode: months term
     zoom_months = {1:1, 2:2, 3:3, 4:4, 5:5, 6:6}
 
+    # longest date range in days
+    max_range_days = 3653
+
+    # columns of JSON chart data
+    ticket_columns = ('id', 'type', 'summary', 'owner', 'status', 'resolution', 'priority',
+                      'due_assign', 'due_close', 'complete', 'estimatedhours', 'totalhours',
+                      'milestone', 'component', 'all_start', 'all_end',
+                      'done_start', 'done_end', 'late_start', 'late_end',
+                      'todo_start', 'todo_end', 'critical', 'slack',
+                      'slack_start', 'slack_end', 'changetime')
+
+    # chart geometry in pixels, see gantt.html
+    px_ti  = 30 # ticket row height
+    px_hd  = 46 # header height
+    px_ch  = 10 # bar height
+    px_top = 13 # top margin of ticket rows
+    px_day = 36 # day width at zoom 1
+
     def __init__(self):
         self.tgc = TracGanttCalendar(self.env)
+        self._grid_cache = LRUCache(self.grid_cache_size)
 
     # INavigationContributor
 
@@ -55,43 +97,106 @@ class TicketGanttChart(Component):
 
         req.perm.require('TICKET_VIEW')
 
+        if req.path_info == '/ticketgantt/description':
+            self.tgc.send_description(req, req.args.getint('id'))
+        if req.path_info == '/ticketgantt/reschedule':
+            self.save_schedule(req)
+        if req.path_info == '/ticketgantt/baseline':
+            self.save_baseline(req)
+
+        portfolio = self.get_portfolio(req)
+        pids = portfolio or [ProjectManagement(self.env).get_current_project(req)]
+        if req.path_info == '/ticketgantt/changes':
+            self.send_changes(req, pids)
+        components = [[c.name for c in model.Component.select(self.env, pid=pid)]
+                      for pid in pids]
+        # baselines are saved and removed without changing tickets
+        baselines = not portfolio and GanttBaselines(self.env).get_baselines(pids[0]) or []
+        ScheduleQuery(self.env).check_modified(req, pids, components,
+                                               [(b['id'], b['time']) for b in baselines])
+
+        if req.path_info in ('/ticketgantt/export.svg', '/ticketgantt/export.png'):
+            self.send_export(req, pids, portfolio, req.path_info.endswith('.png'))
+
+        timer = self.tgc.get_timer()
+        data = self.get_chart_data(req, timer, portfolio, baselines)
+
+        if req.path_info == '/ticketgantt/data.json':
+            self.tgc.send_timing(req, timer)
+            self.tgc.log_timing(req, timer)
+            send_json(req, self.get_chart_json(data))
+
+        with timer.phase('grid'):
+            data['grid'] = self.get_grid(data['first_date'], data['days_term'], data['px_dw'],
+                                         data['first_wkday'], len(data['tickets']),
+                                         data['days_off'])
+
+        # tooltips
+        with timer.phase('tips'):
+            chrome = Chrome(self.env)
+            for t in data['tickets']:
+                self.set_tip(req, chrome, t)
+
+        add_stylesheet(req, 'ganttcalendar/css/chart.css')
+        add_script(req, 'ganttcalendar/js/ganttcalendar.js')
+        export_args = dict((k, v) for k, v in req.args.iteritems() if k != '__FORM_TOKEN')
+        feed = ScheduleChangeFeed(self.env)
+        data['live_href'] = feed.enabled and \
+                req.href.ticketgantt('changes', since=feed.last_seq(), **export_args) or None
+        data['reschedule_href'] = 'TICKET_MODIFY' in req.perm and \
+                req.href.ticketgantt('reschedule') or None
+        data['baseline_href'] = not portfolio and 'TICKET_ADMIN' in req.perm and \
+                req.href.ticketgantt('baseline') or None
+        add_link(req, 'alternate', req.href.ticketgantt('export.svg', **export_args),
+                 _('SVG'), 'image/svg+xml')
+        add_link(req, 'alternate', req.href.ticketgantt('export.png', **export_args),
+                 _('PNG'), 'image/png')
+        if not portfolio:
+            add_ctxtnav(req, _('Workload'), req.href.ticketworkload(year=data['current'].year,
+                                                                 month=data['current'].month))
+
+        data['request_timer'] = timer
+        self.tgc.send_timing(req, timer)
+        return 'gantt.html', data, None
+
+    def get_portfolio(self, req):
+        """Return ids of projects requested in `projects` argument which the
+        user can view, or `None` for the current project chart."""
+        projects = req.args.get('projects')
+        if not projects:
+            return None
+        if not isinstance(projects, list):
+            projects = projects.split(',')
+        allowed = ProjectManagement(self.env).get_user_projects(req.authname)
+        pids = []
+        for pid in projects:
+            try:
+                pid = int(pid)
+            except ValueError:
+                continue
+            if pid in allowed and pid not in pids:
+                pids.append(pid)
+        if not pids:
+            raise TracError(_('None of requested projects is available.'))
+        return pids
+
+    def get_window(self, req, months=None):
+        """Return `(cday, zoom, first_date, last_date, days_term, baseday, px_dw)`
+        of chart requested by `req`.
+
+        Chart covers `from` - `to` dates fitted to `range_width` pixels if both
+        are given, otherwise months of zoom mode, or `months`, from `year` and
+        `month`.
+        """
         ymonth  = req.args.getint('month')
         yyear   = req.args.getint('year')
         baseday = req.args.get('baseday')
 
-        selected_milestone = req.args.get('selected_milestone')
-        selected_component = req.args.get('selected_component')
-        sorted_field       = req.args.get('sorted_field', 'milestone')
-
-        show_my_ticket     = req.args.getbool('show_my_ticket', False)
-        show_closed_ticket = not req.args.getbool('hide_closed_ticket', False)
-
-        show_ticket_summary = req.args.getbool('show_ticket_summary', self.show_ticket_summary)
-        show_ticket_status  = not req.args.getbool('hide_ticket_status', False)
-
-        pm = ProjectManagement(self.env)
-        pid = pm.get_current_project(req)
-
-        fields = TicketSystem(self.env).get_ticket_fields(pid=pid)
-        time_fields = []
-        custom_fields = []
-        for n, f in fields.iteritems():
-            if f['type'] == 'time':
-                time_fields.append(n)
-            if f.get('custom'):
-                custom_fields.append(n)
-
-        if 'complete' not in custom_fields:
-            add_warning(req, _("'complete' field is not defined. Please, check your configuration."))
-
         current_mode = req.args.getint('zoom', self.normal_mode)
         if current_mode < 1 or current_mode > 6:
             current_mode = self.normal_mode
 
-        
-        months_term  = self.zoom_months[current_mode]
-
-        first_wkday = (7 + self.tgc.first_day - 1) % 7
+        months_term = months or self.zoom_months[current_mode]
 
         if baseday:
             try:
@@ -101,158 +206,163 @@ class TicketGanttChart(Component):
         if not baseday:
             baseday = date.today()
 
-        ticket_margin = 12 if show_ticket_summary else 0
+        first_date, last_date = self.get_range(req)
+        if first_date:
+            cday = first_date
+            days_term = (last_date - first_date).days + 1
+            px_dw = min(float(self.range_width) / days_term, self.px_day)
+            return cday, current_mode, first_date, last_date, days_term, baseday, px_dw
 
         if ymonth and yyear:
             cday = date(yyear, ymonth, 1)
         else:
             cday = date.today()
 
-        # next and previous months
-        nmonth = add_months(cday.year, cday.month, 1)
-        pmonth = add_months(cday.year, cday.month, -1)
-
         first_date = cday.replace(day=1)
         last_date  = add_months(cday.year, cday.month, months_term) - timedelta(1)
-        days_term  = ( (first_date + timedelta(months_term*32)).replace(day=1) - first_date ).days
+        days_term  = (last_date - first_date).days + 1
+        px_dw = self.px_day / current_mode
+        return cday, current_mode, first_date, last_date, days_term, baseday, px_dw
+
+    def get_range(self, req):
+        """Return `(from, to)` dates of range mode or `(None, None)`."""
+        if not req.args.get('from') or not req.args.get('to'):
+            return None, None
+        try:
+            first_date = parse_date_only(req.args['from'])
+            last_date = parse_date_only(req.args['to'])
+        except TracError:
+            return None, None
+        if first_date > last_date:
+            return None, None
+        return first_date, min(last_date, first_date + timedelta(self.max_range_days - 1))
+
+    def get_scale(self, px_dw):
+        """Return grid columns shown at `px_dw` pixels per day: 'day', 'week'
+        or 'month'."""
+        if px_dw >= 6:
+            return 'day'
+        if px_dw >= 1.5:
+            return 'week'
+        return 'month'
+
+    def get_chart_data(self, req, timer=null_timer, portfolio=None, baselines=None):
+        selected_milestone = req.args.get('selected_milestone')
+        selected_component = req.args.get('selected_component')
+        sorted_field       = req.args.get('sorted_field')
+        if sorted_field not in ScheduleQuery.sort_fields:
+            sorted_field = 'milestone'
 
-        # process ticket
-        db = self.env.get_read_db()
-        cursor = db.cursor();
-        conditions = []
-        args = []
-
-        conditions.append('t.project_id = %s')
-        args.append(pid)
-
-        conditions.append("(a.due_assign, c.due_close + INTERVAL '1 DAY')"
-                          " OVERLAPS (DATE '%s', DATE '%s')" % (
-                          first_date.isoformat(), last_date.isoformat()))
-
-        if show_my_ticket:
-            conditions.append('owner=%s')
-            args.append(req.authname)
-        if not show_closed_ticket:
-            conditions.append("status <> 'closed'")
-        if selected_milestone:
-            conditions.append('milestone=%s')
-            args.append(selected_milestone)
-        if selected_component:
-            conditions.append('component=%s')
-            args.append(selected_component)
-
-        condition = "WHERE " + ' AND '.join(conditions)
-            
-        sql = '''
-            SELECT id, type, summary, owner, t.description, status, resolution, priority,
-                   a.due_assign, c.due_close,
-                   cmp.value, est.value, tot.value, milestone, component
-            FROM ticket t
-            JOIN (
-                SELECT ticket, CAST(value AS DATE) AS due_assign
-                FROM ticket_custom
-                WHERE name = 'due_assign' AND value IS NOT NULL
-            ) a ON a.ticket = t.id
-            JOIN (
-                SELECT ticket, CAST(value AS DATE) AS due_close
-                FROM ticket_custom
-                WHERE name = 'due_close' AND value IS NOT NULL
-            ) c ON c.ticket = t.id
-            JOIN ticket_custom cmp ON cmp.ticket = t.id AND cmp.name = 'complete'
-            LEFT OUTER JOIN ticket_custom est ON est.ticket = t.id AND est.name = 'estimatedhours'
-            LEFT OUTER JOIN ticket_custom tot ON tot.ticket = t.id AND tot.name = 'totalhours'
-            %s
-            ORDER by %s, a.due_assign
-            ''' % (condition, db.quote(sorted_field))
-        
-        self.log.debug(sql)
-        cursor.execute(sql, args)
-
-        time_tracking = 'estimatedhours' in fields
-        sum_estimatedhours = 0.0
-        sum_totalhours = 0.0
-
-        tickets=[]
-        for id_, type_, summary, owner, description, status, resolution, priority, due_assign, due_close, complete, estimatedhours, totalhours, milestone, component in cursor:
-            due_assign_date = due_assign
-            due_close_date  = due_close
-            complete        = convert_field_value(fields.get('complete'), complete, 0)
-
-            if not due_assign_date or not due_close_date or due_assign_date > due_close_date:
-                continue
-            if not milestone:
-                milestone = "*"
-            if not component:
-                component = "*"
-
-            # time tracking
-            if time_tracking:
-                estimatedhours = convert_field_value(fields.get('estimatedhours'), estimatedhours, 0.0)
-                totalhours = convert_field_value(fields.get('totalhours'), totalhours, 0.0)
-                sum_estimatedhours += estimatedhours
-                sum_totalhours += totalhours
-
-            ticket = {'id':id_, 'type':type_, 'summary':summary, 'owner':owner, 'description': description, 'status':status,
-                    'resolution':resolution, 'priority':priority,
-                    'due_assign':due_assign_date, 'due_close':due_close_date, 'complete': complete, 
-                    'estimatedhours':estimatedhours, 'totalhours':totalhours,
-                    'milestone': milestone,'component': component}
-
-            #calc chart
-            base = (baseday -first_date).days + 1
-            done_start = done_end = None
-            late_start = late_end = None
-            todo_start = todo_end = None
-            all_start = (due_assign_date-first_date).days
-            all_end   = (due_close_date-first_date).days + 1
-            done_start = all_start
-            done_end   = done_start + (all_end - all_start) * complete / 100.0
-            if all_end <= base:
-                late_start = done_end
-                late_end   = all_end
-            elif done_end <= base < all_end:
-                late_start = done_end
-                late_end   = todo_start= base
-                todo_end= all_end
-            else:
-                todo_start = done_end
-                todo_end   = all_end
-            #
-            done_start, done_end = self.adjust(done_start, done_end, days_term)
-            late_start, late_end = self.adjust(late_start, late_end, days_term)
-            todo_start, todo_end = self.adjust(todo_start, todo_end, days_term)
-            all_start,  all_end  = self.adjust(all_start,  all_end,  days_term)
-
-            if done_start != None:
-                ticket.update({'done_start':done_start,'done_end':done_end})
-            if late_start != None:
-                ticket.update({'late_start':late_start,'late_end':late_end})
-            if todo_start != None:
-                ticket.update({'todo_start':todo_start,'todo_end':todo_end})
-            if all_start != None:
-                ticket.update({'all_start':all_start,'all_end':all_end})
-
-            self.log.debug(ticket)
-            tickets.append(ticket)
+        show_my_ticket     = req.args.getbool('show_my_ticket', False)
+        show_closed_ticket = not req.args.getbool('hide_closed_ticket', False)
+
+        show_ticket_summary = req.args.getbool('show_ticket_summary', self.show_ticket_summary)
+        show_ticket_status  = not req.args.getbool('hide_ticket_status', False)
 
-        # time tracking
-        if not time_tracking:
-            sum_estimatedhours = None
+        limit  = max(req.args.getint('limit', self.rows_per_page), 0)
+        offset = limit and max(req.args.getint('offset', 0), 0)
 
-        # milestones
-        milestones = {'':None}
-        milestones_list = model.Milestone.select(self.env, pid=pid, db=db)
-        for m in milestones_list:
-            d = m.due
-            if d:
-                d = d.date()
-            milestones[m.name] = {
-                'due': d,
-                'description': m.description,
-            }
-
-        # components
-        components = list(model.Component.select(self.env, pid=pid, db=db))
+        pm = ProjectManagement(self.env)
+        pid = pm.get_current_project(req)
+
+        if portfolio:
+            # tickets are grouped by project, milestones and components
+            # are specific to projects
+            sorted_field = 'project'
+            selected_milestone = selected_component = None
+
+        cday, current_mode, first_date, last_date, days_term, baseday, px_dw = \
+            self.get_window(req)
+        date_range = self.get_range(req)
+        span = timedelta(days_term)
+
+        first_wkday = (7 + self.tgc.first_day - 1) % 7
+        workdays = WorkingCalendar(self.env).get_workdays(pid)
+        # shade days off of every project of a portfolio
+        days_off = WorkingCalendar(self.env).get_days_off(portfolio or [pid], first_date,
+                                                          days_term)
+
+        ticket_margin = 12 if show_ticket_summary else 0
+
+        # next and previous months
+        nmonth = add_months(cday.year, cday.month, 1)
+        pmonth = add_months(cday.year, cday.month, -1)
+
+        # process ticket
+        query = {
+            'owner': show_my_ticket and req.authname or None,
+            'show_closed': show_closed_ticket, 'milestone': selected_milestone,
+            'component': selected_component, 'order': sorted_field,
+            'description': not self.tgc.lazy_description,
+        }
+        if portfolio:
+            query['order'] = 'milestone'
+            with timer.phase('projects'):
+                projects = self.load_projects(portfolio, lambda pid:
+                        self.load_project(pid, first_date, last_date, query))
+            tickets = []
+            sum_estimatedhours = sum_totalhours = None
+            for project in projects:
+                name = pm.get_project_info(project['id'])['name']
+                for ticket in project['tickets']:
+                    ticket['project'] = name
+                tickets.extend(project['tickets'])
+                if project['sum_estimatedhours'] is not None:
+                    sum_estimatedhours = (sum_estimatedhours or 0.0) + project['sum_estimatedhours']
+                    sum_totalhours = (sum_totalhours or 0.0) + project['sum_totalhours']
+            total = len(tickets)
+            timer.count('projects', len(projects))
+            if offset and offset >= total:
+                # filter or date range changed, show the last page
+                offset = max(total - 1, 0) / limit * limit
+            if limit:
+                tickets = tickets[offset:offset + limit]
+            milestones = {'':None}
+            components = []
+        else:
+            project = self.load_project(pid, first_date, last_date, query, offset, limit, timer)
+            if offset and offset >= project['total']:
+                # filter or date range changed, show the last page
+                offset = max(project['total'] - 1, 0) / limit * limit
+                project = self.load_project(pid, first_date, last_date, query, offset, limit,
+                                            timer)
+            projects = [project]
+            tickets, total = project['tickets'], project['total']
+            sum_estimatedhours = project['sum_estimatedhours']
+            sum_totalhours = project['sum_totalhours']
+            milestones, components = project['milestones'], project['components']
+
+        for project in projects:
+            complete = project['fields'].complete
+            if not complete or not complete.get('custom'):
+                add_warning(req, _("'complete' field is not defined. Please, check your configuration."))
+                break
+        cycle = [t['id'] for t in tickets if t.get('cycle')]
+        if cycle:
+            add_warning(req, _('Dependencies of tickets %(tickets)s form a cycle, '
+                               'critical path is not computed for them.',
+                               tickets=', '.join('#%d' % id_ for id_ in cycle)))
+
+        with timer.phase('geometry'):
+            for ticket in tickets:
+                self.set_geometry(ticket, first_date, baseday, days_term)
+
+        # baseline
+        if baselines is None:
+            baselines = not portfolio and GanttBaselines(self.env).get_baselines(pid) or []
+        baseline = not portfolio and req.args.getint('baseline') or None
+        if baseline:
+            with timer.phase('baseline'):
+                plans, slips = GanttBaselines(self.env).get_variance(pid, baseline, workdays)
+                for ticket in tickets:
+                    plan = plans.get(ticket['id'])
+                    if plan:
+                        self.set_baseline(ticket, plan, first_date, days_term)
+                for name, slip in slips.iteritems():
+                    if milestones.get(name):
+                        milestones[name]['slip'] = slip
+
+        timer.count('page', len(tickets))
 
         data = {
             'baseday': baseday, 'current':cday, 'prev':pmonth, 'next':nmonth, 'month_tbl': month_tbl,
@@ -260,19 +370,500 @@ class TicketGanttChart(Component):
             'show_ticket_summary': show_ticket_summary, 'show_ticket_status': show_ticket_status, 'ti_mrgn': ticket_margin,
             'selected_milestone':selected_milestone,'selected_component': selected_component,
             'tickets':tickets,'milestones':milestones,'components':components,
+            'portfolio':portfolio, 'baselines':baselines, 'baseline':baseline,
+            'total':total, 'offset':offset, 'limit':limit,
+            'lazy_description': self.tgc.lazy_description,
             'sum_estimatedhours':sum_estimatedhours, 'sum_totalhours':sum_totalhours,
-            'first_date':first_date,'days_term':days_term,
-            'calendar':calendar,
+            'first_date':first_date,'last_date':last_date,'days_term':days_term,
+            'date_range': date_range[0] and date_range,
+            'prev_range': (first_date - span, first_date - timedelta(1)),
+            'next_range': (last_date + timedelta(1), last_date + span),
+            'px_ti': self.px_ti, 'px_hd': self.px_hd, 'px_ch': self.px_ch, 'px_top': self.px_top,
+            'px_dw': px_dw, 'scale': self.get_scale(px_dw),
             'date_format': date_format ,'first_wkday':first_wkday,'normal':self.normal_mode,'zoom':current_mode,
+            'days_off': days_off,
             '_':_,
         }
 
-        add_stylesheet(req, 'ganttcalendar/css/chart.css')
+        return data
+
+    def set_geometry(self, ticket, first_date, baseday, days_term):
+        """Set bar segments of `ticket` in days from `first_date`."""
+        if not ticket['milestone']:
+            ticket['milestone'] = "*"
+        if not ticket['component']:
+            ticket['component'] = "*"
+
+        #calc chart
+        base = (baseday -first_date).days + 1
+        done_start = done_end = None
+        late_start = late_end = None
+        todo_start = todo_end = None
+        all_start = (ticket['due_assign']-first_date).days
+        all_end   = (ticket['due_close']-first_date).days + 1
+        done_start = all_start
+        done_end   = done_start + (all_end - all_start) * ticket['complete'] / 100.0
+        if all_end <= base:
+            late_start = done_end
+            late_end   = all_end
+        elif done_end <= base < all_end:
+            late_start = done_end
+            late_end   = todo_start= base
+            todo_end= all_end
+        else:
+            todo_start = done_end
+            todo_end   = all_end
+        #
+        done_start, done_end = self.adjust(done_start, done_end, days_term)
+        late_start, late_end = self.adjust(late_start, late_end, days_term)
+        todo_start, todo_end = self.adjust(todo_start, todo_end, days_term)
+        all_start,  all_end  = self.adjust(all_start,  all_end,  days_term)
+
+        if done_start != None:
+            ticket.update({'done_start':done_start,'done_end':done_end})
+        if late_start != None:
+            ticket.update({'late_start':late_start,'late_end':late_end})
+        if todo_start != None:
+            ticket.update({'todo_start':todo_start,'todo_end':todo_end})
+        if all_start != None:
+            ticket.update({'all_start':all_start,'all_end':all_end})
+
+        if ticket.get('slack'):
+            slack_start, slack_end = self.adjust(
+                    (ticket['early_finish'] - first_date).days + 1,
+                    (ticket['late_finish'] - first_date).days + 1, days_term)
+            if slack_start != None:
+                ticket.update({'slack_start':slack_start,'slack_end':slack_end})
+
+    def set_baseline(self, ticket, plan, first_date, days_term):
+        """Set slip and baseline bar of `ticket` in days from `first_date`."""
+        ticket['slip'] = plan['slip']
+        if not plan['due_assign'] or not plan['due_close']:
+            return
+        start, end = self.adjust((plan['due_assign'] - first_date).days,
+                                 (plan['due_close'] - first_date).days + 1, days_term)
+        if start is not None and end > start:
+            ticket.update({'baseline_start': start, 'baseline_end': end,
+                           'baseline_assign': plan['due_assign'],
+                           'baseline_close': plan['due_close']})
+
+    def set_tip(self, req, chrome, t):
+        t['due_label'] = '(%d/%d ~ %d/%d)' % (t['due_assign'].month, t['due_assign'].day,
+                                              t['due_close'].month, t['due_close'].day)
+        hours = t['estimatedhours'] is not None and ' %sh' % round(t['estimatedhours'], 2) or ''
+        t['tip'] = '%s#%d: %s - %s %s%s' % (t['type'], t['id'], t['summary'],
+                                           chrome.format_author(req, t['owner']),
+                                           t['due_label'], hours)
+
+    def save_schedule(self, req):
+        """Save dates and progress of tickets posted in `changes` argument,
+        a JSON list of objects with `id`, the `changetime` of the ticket shown
+        on the chart and any of `due_assign`, `due_close` and `complete`.
+
+        Changes of the same ticket are merged. Tickets changed since they
+        were shown, unparseable dates, progress outside 0..100 and close
+        dates before assign dates are reported as errors. All tickets are
+        validated by ticket manipulators first and saved in one transaction
+        only if none of them has errors, then notifications are sent.
+        Responds with `{'saved': ids}` or with
+        `{'errors': [{'id', 'field', 'message'}]}` and status 400.
+        """
+        if req.method != 'POST':
+            raise TracError(_('Schedule changes must be posted.'))
+        try:
+            changes = json.loads(req.args.get('changes') or '[]')
+            changes = [(int(c['id']), c) for c in changes]
+        except (ValueError, TypeError, KeyError):
+            raise TracError(_('Invalid schedule changes.'))
+        # later changes of the same ticket win
+        merged = {}
+        for id_, change in changes:
+            merged.setdefault(id_, {}).update(change)
+        changes = sorted(merged.iteritems())
+
+        tickets = []
+        errors = []
+        def error(id_, field, message):
+            item = {'id': id_, 'field': field, 'message': unicode(message)}
+            if item not in errors:
+                errors.append(item)
+        for id_, change in changes:
+            try:
+                ticket = model.Ticket(self.env, id_)
+            except ResourceNotFound:
+                error(id_, None, _('Ticket %(id)s does not exist.', id=id_))
+                continue
+            if 'TICKET_MODIFY' not in req.perm(ticket.resource):
+                error(id_, None, _('No permission to modify ticket.'))
+                continue
+            # mid-air collision, the chart may be older than the ticket
+            if change.get('changetime') != to_utimestamp(ticket['changetime']):
+                error(id_, None, _('Ticket has been modified since the chart was '
+                                   'loaded. Reload the chart and try again.'))
+                continue
+            for field in ('due_assign', 'due_close'):
+                if field not in change:
+                    continue
+                value = to_date(change[field])
+                if value is None:
+                    error(id_, field, _("'%(value)s' is not a valid date.",
+                                        value=change[field]))
+                    continue
+                ticket[field] = value.strftime(date_format)
+            due_assign, due_close = to_date(ticket['due_assign']), to_date(ticket['due_close'])
+            if due_assign and due_close and due_assign > due_close:
+                error(id_, 'due_close', _('Close date must not be less than assign date'))
+            if 'complete' in change:
+                try:
+                    complete = int(change['complete'])
+                except (TypeError, ValueError):
+                    complete = None
+                if complete is None or not 0 <= complete <= 100:
+                    error(id_, 'complete', _("'%(val)s' is invalid value. It must be "
+                                             "integer in the range from 0 to 100",
+                                             val=change['complete']))
+                else:
+                    ticket['complete'] = unicode(complete)
+            for manipulator in self.ticket_manipulators:
+                # dates are changed without a workflow transition
+                for field, message in manipulator.validate_ticket(req, ticket, 'leave'):
+                    error(id_, field, message)
+            tickets.append(ticket)
+        if errors:
+            send_json(req, {'errors': errors}, 400)
+
+        when = datetime.now(utc)
+        @self.env.with_transaction()
+        def do_save(db):
+            for ticket in tickets:
+                ticket.save_changes(req.authname, '', when=when, db=db)
+        for ticket in tickets:
+            try:
+                TicketNotifyEmail(self.env).notify(ticket, newticket=False, modtime=when)
+            except Exception as e:
+                self.log.error("Failure sending notification on change to ticket #%s: %s",
+                               ticket.id, exception_to_unicode(e))
+        send_json(req, {'saved': [ticket.id for ticket in tickets]})
+
+    def save_baseline(self, req):
+        """Save current schedule of the project as baseline named by `name`
+        argument and show the chart compared with it."""
+        if req.method != 'POST':
+            raise TracError(_('Baselines must be posted.'))
+        req.perm.require('TICKET_ADMIN')
+        pid = ProjectManagement(self.env).get_current_project(req)
+        ids = []
+        @self.env.with_transaction()
+        def do_save(db):
+            ids.append(GanttBaselines(self.env).create_baseline(db, pid, req.args.get('name'),
+                                                                req.authname))
+        req.redirect(req.href.ticketgantt(baseline=ids[0]))
+
+    def send_changes(self, req, pids):
+        """Stream changed tickets of projects `pids` with bar geometry of the
+        chart requested by `req`, so open charts can redraw single rows.
+        Deleted tickets, tickets without valid dates and milestone changes
+        ask the page to reload."""
+        cday, zoom, first_date, last_date, days_term, baseday, px_dw = self.get_window(req)
+        schedule = ScheduleQuery(self.env)
+        chrome = Chrome(self.env)
+        columns = self.ticket_columns + ('tip',)
+
+        def render(change):
+            due_assign, due_close = change.get('due_assign'), change.get('due_close')
+            if 'ticket' not in change or change['deleted'] or not due_assign or \
+                    not due_close or due_assign > due_close:
+                return {'id': change.get('ticket'), 'reload': True}
+            pid = change['pid']
+            fields = schedule.get_fields(pid)
+            ticket = ScheduleRow(change['ticket'], change['type'], change['summary'],
+                                 change['owner'], None, change['status'],
+                                 change['resolution'], change['priority'],
+                                 due_assign, due_close, fields.to_complete(change['complete'], 0),
+                                 None, None, change['milestone'], change['component'],
+                                 change['changetime'])
+            if fields.time_tracking:
+                ticket['estimatedhours'] = fields.to_estimatedhours(change['estimatedhours'], 0.0)
+                ticket['totalhours'] = fields.to_totalhours(change['totalhours'], 0.0)
+            critical_path = CriticalPath(self.env).get_schedule(pid)
+            path = critical_path and critical_path.tickets.get(ticket['id'])
+            if path:
+                ticket.update({'critical': path['critical'], 'slack': path['slack'],
+                               'early_finish': path['ef'], 'late_finish': path['lf']})
+            self.set_geometry(ticket, first_date, baseday, days_term)
+            self.set_tip(req, chrome, ticket)
+            return dict((name, values[0]) for name, values
+                        in to_columns([ticket], columns).iteritems())
+
+        ScheduleChangeFeed(self.env).send_changes(req, pids, render)
+
+    def send_export(self, req, pids, portfolio=False, png=False):
+        """Send chart of projects `pids` as SVG, or PNG if `png` is true.
+
+        SVG is streamed while tickets are read from the database, so charts
+        of any number of tickets are sent in constant memory. `months`
+        argument sets chart length up to ten years.
+        """
+        months = min(max(req.args.getint('months', 0), 0), 120)
+        cday, zoom, first_date, last_date, days_term, baseday, px_dw = \
+            self.get_window(req, months)
+
+        sorted_field = not portfolio and req.args.get('sorted_field')
+        if sorted_field not in ScheduleQuery.sort_fields:
+            sorted_field = 'milestone'
+        query = {
+            'owner': req.args.getbool('show_my_ticket', False) and req.authname or None,
+            'show_closed': not req.args.getbool('hide_closed_ticket', False),
+            'milestone': not portfolio and req.args.get('selected_milestone') or None,
+            'component': not portfolio and req.args.get('selected_component') or None,
+        }
+        schedule = ScheduleQuery(self.env)
+        pm = ProjectManagement(self.env)
+        rows = sum(schedule.count_tickets(pid, first_date, last_date, **query) for pid in pids)
+        days_off = WorkingCalendar(self.env).get_days_off(pids, first_date, days_term)
+        writer = GanttSvgWriter(first_date, days_term, baseday, rows, px_dw,
+                                self.px_ti, self.px_hd, self.px_ch, self.px_top,
+                                '%s ~ %s' % (first_date, last_date), days_off,
+                                self.get_weekdays())
+
+        def svg():
+            for markup in writer.start():
+                yield markup
+            cnt = 0
+            for pid in pids:
+                milestones = dict((m.name, m.due and m.due.date())
+                                  for m in model.Milestone.select(self.env, pid=pid))
+                critical_path = CriticalPath(self.env).get_schedule(pid)
+                name = portfolio and pm.get_project_info(pid)['name']
+                for ticket in schedule.iter_tickets(pid, first_date, last_date,
+                                                    order=sorted_field, **query):
+                    if cnt >= rows:
+                        break
+                    ticket['milestone_due'] = milestones.get(ticket['milestone'])
+                    path = critical_path and critical_path.tickets.get(ticket['id'])
+                    if path:
+                        ticket.update({'critical': path['critical'], 'slack': path['slack'],
+                                       'early_finish': path['ef'], 'late_finish': path['lf']})
+                    self.set_geometry(ticket, first_date, baseday, days_term)
+                    for markup in writer.row(cnt, ticket, name or ticket.get(sorted_field)):
+                        yield markup
+                    cnt += 1
+            for markup in writer.end():
+                yield markup
+
+        if png:
+            data = svg_to_png(u''.join(svg()).encode('utf-8'))
+            if data is None:
+                raise TracError(_('PNG export requires cairosvg package.'))
+            req.send(data, 'image/png')
+        send_stream(req, (markup.encode('utf-8') for markup in svg()), 'image/svg+xml')
+
+    def load_project(self, pid, first_date, last_date, query, offset=0, limit=None,
+                     timer=null_timer):
+        """Return scheduled tickets, `ScheduleFields`, milestones and components
+        of project `pid`. `query` holds `ScheduleQuery.get_tickets` filters."""
+        schedule = ScheduleQuery(self.env)
+        fields = schedule.get_fields(pid)
+        tickets, total, sum_estimatedhours, sum_totalhours = \
+                schedule.get_tickets(pid, first_date, last_date,
+                                                    offset=offset, limit=limit,
+                                                    timer=timer, **query)
 
-        return 'gantt.html', data, None
+        db = self.env.get_read_db()
+
+        # milestones
+        with timer.phase('milestones'):
+            milestones = {'':None}
+            milestones_list = model.Milestone.select(self.env, pid=pid, db=db)
+            for m in milestones_list:
+                d = m.due
+                if d:
+                    d = d.date()
+                milestones[m.name] = {
+                    'due': d,
+                    'description': m.description,
+                    'slip': None,
+                }
+
+            # components
+            components = list(model.Component.select(self.env, pid=pid, db=db))
+
+        # critical path
+        critical_path = CriticalPath(self.env).get_schedule(pid)
+        cycle = critical_path and critical_path.cycle or ()
+
+        for ticket in tickets:
+            ticket['pid'] = pid
+            ticket['milestone_due'] = (milestones.get(ticket['milestone']) or {}).get('due')
+            if critical_path:
+                path = critical_path.tickets.get(ticket['id'])
+                if path:
+                    ticket.update({'critical': path['critical'], 'slack': path['slack'],
+                                   'early_finish': path['ef'], 'late_finish': path['lf']})
+                ticket['cycle'] = ticket['id'] in cycle
+
+        return {
+            'id': pid, 'tickets': tickets, 'total': total,
+            'sum_estimatedhours': sum_estimatedhours, 'sum_totalhours': sum_totalhours,
+            'fields': fields, 'milestones': milestones, 'components': components,
+        }
+
+    def load_projects(self, pids, load):
+        """Return `load(pid)` results of projects `pids` in the same order,
+        calling `load` on at most `portfolio_threads` threads at once."""
+        results = {}
+        errors = []
+        queue = Queue()
+        for pid in pids:
+            queue.put(pid)
+
+        def worker():
+            try:
+                while not errors:
+                    try:
+                        pid = queue.get_nowait()
+                    except Empty:
+                        break
+                    try:
+                        results[pid] = load(pid)
+                    except Exception as e:
+                        self.log.error('Loading project %s failed', pid, exc_info=True)
+                        errors.append(e)
+            finally:
+                # give back database connection of this thread
+                self.env.shutdown(threading._get_ident())
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(max(self.portfolio_threads, 1), len(pids)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return [results[pid] for pid in pids]
+
+    def get_chart_json(self, data):
+        columns = self.ticket_columns
+        if data['portfolio']:
+            columns += ('pid', 'project')
+        milestones = [(name, m['due']) for name, m in data['milestones'].iteritems() if m]
+        return {
+            'first_date': data['first_date'].isoformat(), 'days_term': data['days_term'],
+            'last_date': data['last_date'].isoformat(), 'px_dw': data['px_dw'],
+            'scale': data['scale'],
+            'total': data['total'], 'offset': data['offset'], 'limit': data['limit'],
+            'baseday': data['baseday'].isoformat(), 'zoom': data['zoom'],
+            'sum_estimatedhours': data['sum_estimatedhours'], 'sum_totalhours': data['sum_totalhours'],
+            'tickets': to_columns(data['tickets'], columns),
+            'milestones': to_columns([{'name': n, 'due': d} for n, d in milestones], ('name', 'due')),
+        }
 
     #
 
+    def get_weekdays(self):
+        """Return translated weekday labels of the chart, Monday first."""
+        return [_('Mo'), _('Tu'), _('We'), _('Th'), _('Fr'), _('Sa'), _('Su')]
+
+    def get_grid(self, first_date, days_term, px_dw, first_wkday, maxtic, days_off=()):
+        """Return rendered header and background of the chart. Non-working
+        days at offsets `days_off` from `first_date` are shaded."""
+        weekdays = self.get_weekdays()
+        key = (first_date, days_term, px_dw, first_wkday, maxtic, tuple(weekdays),
+               tuple(days_off))
+        grid = self._grid_cache.get(key)
+        if grid is None:
+            grid = self._render_grid(first_date, days_term, px_dw, first_wkday,
+                                     maxtic, weekdays, days_off)
+            self._grid_cache.set(key, grid)
+        return grid
+
+    def _render_grid(self, first_date, days_term, px_dw, first_wkday, maxtic, weekdays,
+                     days_off):
+        px_ti, px_hd, px_top = self.px_ti, self.px_hd, self.px_top
+        px_height = px_top + self.px_ch
+        px_cell = (px_hd-4)/3
+        cell = '<div class="hdr hdr_title" style="left:%dpx;top:%dpx;width: %dpx;height:%dpx;">%s</div>'
+
+        html = []
+        # back ground stripe
+        for cnt in reversed(range(maxtic)):
+            if cnt % 2:
+                html.append('<div class="stripe" style="left: 1px; top: %dpx; width: %dpx; height: %dpx;"></div>'
+                            % (px_ti*cnt+px_hd+px_top, px_dw*days_term-1, px_ti))
+        scale = self.get_scale(px_dw)
+        if scale != 'day':
+            html.extend(self._render_columns(first_date, days_term, px_dw, scale,
+                                             first_wkday, maxtic))
+            return Markup('\n'.join(html))
+        # head and sun,sta,holiday
+        days_off = set(days_off)
+        for cnt in reversed(range(days_term)):
+            cur = first_date + timedelta(cnt)
+            wk = cur.weekday()
+            if cur.day == 1:
+                days_thismonth = calendar.monthrange(cur.year, cur.month)[1]
+                html.append(cell % (px_dw*cnt+1, 1, days_thismonth*px_dw-1, px_cell,
+                                    '%d/%d' % (cur.year, cur.month)))
+            if wk == first_wkday:
+                if cnt+7 <= days_term:
+                    html.append(cell % (px_dw*cnt+1, px_cell+2, px_dw*7-1, px_cell,
+                                        '%d/%d' % (cur.month, cur.day)))
+                else:
+                    html.append(cell % (px_dw*cnt+1, px_cell+2, px_dw*(days_term-cnt)-1, px_cell, ''))
+            html.append(cell % (px_dw*cnt+1, px_cell*2+3, px_dw-1, px_cell,
+                                px_dw >= 12 and escape(weekdays[wk]) or ''))
+            if cnt in days_off:
+                html.append('<div class="border_line" style="position:absolute;top:%dpx; left: %dpx; width: %dpx; height: %dpx;">'
+                            '<div class="hdr" style="top:0px; left:1px; width: %dpx; height: %dpx;"></div></div>'
+                            % (px_hd, px_dw*cnt, px_dw+1, maxtic*px_ti+1+px_height,
+                               px_dw-1, maxtic*px_ti+px_height))
+            if px_dw >= 18:
+                html.append(cell % (px_dw*cnt+1, px_hd, px_dw-1, px_cell, cur.day))
+        # partial first week
+        first_wk = first_date.weekday()
+        if first_wk < first_wkday:
+            html.append(cell % (1, px_cell+2, px_dw*(first_wkday-first_wk)-1, px_cell, ''))
+        elif first_wk > first_wkday:
+            html.append(cell % (1, px_cell+2, px_dw*(first_wkday+7-first_wk)-1, px_cell, ''))
+        return Markup('\n'.join(html))
+
+    def _render_columns(self, first_date, days_term, px_dw, scale, first_wkday, maxtic):
+        """Return header and column borders of a chart showing weeks or months,
+        one element per column instead of per day."""
+        px_cell = (self.px_hd-4)/3
+        cell = '<div class="hdr hdr_title" style="left:%dpx;top:%dpx;width: %dpx;height:%dpx;">%s</div>'
+        border = '<div class="border_line" style="position:absolute;top:%dpx;left:%dpx;width:1px;height:%dpx;"></div>'
+        height = maxtic*self.px_ti + self.px_top + self.px_ch
+
+        if scale == 'week':
+            top = lambda d: add_months(d.year, d.month, 1)
+            column = lambda d: d + timedelta(7 - (d.weekday() - first_wkday) % 7)
+            top_label = lambda d: '%d/%d' % (d.year, d.month)
+            label = lambda d: '%d/%d' % (d.month, d.day)
+        else:
+            top = lambda d: date(d.year + 1, 1, 1)
+            column = lambda d: add_months(d.year, d.month, 1)
+            top_label = lambda d: '%d' % d.year
+            label = lambda d: '%d' % d.month
+
+        html = []
+        for next_start, row, labeled in ((top, 0, top_label), (column, 1, label)):
+            cur = first_date
+            while (cur - first_date).days < days_term:
+                start = (cur - first_date).days
+                end = min((next_start(cur) - first_date).days, days_term)
+                left = int(start * px_dw)
+                width = int(end * px_dw) - left
+                text = labeled(cur)
+                html.append(cell % (left+1, row*(px_cell+1)+1, width-1, px_cell,
+                                    width >= len(text)*6+4 and escape(text) or ''))
+                if row and start:
+                    html.append(border % (self.px_hd, left, height))
+                cur = first_date + timedelta(end)
+        html.append(cell % (1, px_cell*2+3, px_dw*days_term-1, px_cell, ''))
+        return html
+
     def adjust( self, x_start, x_end, term):
         if x_start > term or x_end < 0:
             x_start= None
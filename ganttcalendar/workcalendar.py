@@ -0,0 +1,150 @@
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from threading import RLock
+
+from trac.core import Component
+from trac.config import ListOption
+
+from trac.project.api import ProjectManagement
+
+from ganttcalendar.api import TracGanttCalendar, to_date
+
+
+__all__ = ['WorkingCalendar', 'WorkDays']
+
+
+class WorkDays(object):
+    """Working days of a calendar.
+
+    Non-working days are the `weekend` weekdays (Monday is 0) and
+    `holidays`, a dict mapping dates to descriptions. Holidays falling on
+    working weekdays are kept as a sorted array of day ordinals, so that
+    checking a day or counting working days of a range takes logarithmic
+    time.
+    """
+
+    def __init__(self, weekend=(5, 6), holidays=None):
+        self.weekend = frozenset(weekend)
+        self.holidays = holidays or {}
+        self._working = [wday not in self.weekend for wday in range(7)]
+        self._ordinals = sorted(d.toordinal() for d in self.holidays
+                                if d.weekday() not in self.weekend)
+
+    def is_working(self, day):
+        if not self._working[day.weekday()]:
+            return False
+        ordinal = day.toordinal()
+        i = bisect_left(self._ordinals, ordinal)
+        return i == len(self._ordinals) or self._ordinals[i] != ordinal
+
+    def next_working(self, day):
+        """Return first working day from `day` on, `None` if there is none
+        within a year."""
+        for i in range(366):
+            if self.is_working(day + timedelta(i)):
+                return day + timedelta(i)
+        return None
+
+    def description(self, day):
+        """Return description of holiday `day`, `None` for other days."""
+        return self.holidays.get(day)
+
+    def working_days(self, first, last):
+        """Return number of working days in `first`..`last`."""
+        if first > last:
+            return 0
+        weeks, rest = divmod((last - first).days + 1, 7)
+        count = weeks * sum(self._working)
+        wday = first.weekday()
+        for i in range(rest):
+            if self._working[(wday + i) % 7]:
+                count += 1
+        return count - (bisect_right(self._ordinals, last.toordinal()) -
+                        bisect_left(self._ordinals, first.toordinal()))
+
+    def days_off(self, first, days):
+        """Return sorted offsets from `first` of non-working days among the
+        `days` days starting at `first`."""
+        wday = first.weekday()
+        offsets = [i for i in range(days) if not self._working[(wday + i) % 7]]
+        start = first.toordinal()
+        lo = bisect_left(self._ordinals, start)
+        hi = bisect_left(self._ordinals, start + days)
+        if lo < hi:
+            offsets.extend(ordinal - start for ordinal in self._ordinals[lo:hi])
+            offsets.sort()
+        return offsets
+
+
+class WorkingCalendar(Component):
+    """Weekends and holidays of projects, configured per syllabus."""
+
+    weekend_days = ListOption('ganttcalendar', 'weekend_days', '5, 6',
+        doc='Non-working weekdays, 0 is Monday and 6 is Sunday', switcher=True)
+
+    holidays = ListOption('ganttcalendar', 'holidays', '',
+        doc='Non-working days as ISO dates or date ranges with an optional '
+            'description, e.g. `2026-12-24..2027-01-06=Winter break, 2027-05-01`',
+        switcher=True)
+
+    def __init__(self):
+        self._workdays = {}
+        self._lock = RLock()
+
+    def get_workdays(self, pid):
+        """Return `WorkDays` of project `pid`. Calendars are built once per
+        distinct configuration."""
+        syllabus_id = pid is not None and \
+                      ProjectManagement(self.env).get_project_syllabus(pid) or None
+        tgc = TracGanttCalendar(self.env)
+        key = (tuple(tgc.syllabus_option(self, 'weekend_days', syllabus_id)),
+               tuple(tgc.syllabus_option(self, 'holidays', syllabus_id)))
+        self._lock.acquire()
+        try:
+            workdays = self._workdays.get(key)
+            if workdays is None:
+                workdays = self._workdays[key] = WorkDays(self._parse_weekend(key[0]),
+                                                          self._parse_holidays(key[1]))
+            return workdays
+        finally:
+            self._lock.release()
+
+    def get_days_off(self, pids, first, days):
+        """Return sorted offsets from `first` of the days among the `days`
+        days starting at `first` that are non-working in all projects
+        `pids`."""
+        offsets = None
+        for workdays in set(self.get_workdays(pid) for pid in pids):
+            days_off = set(workdays.days_off(first, days))
+            offsets = days_off if offsets is None else offsets & days_off
+        return sorted(offsets or ())
+
+    #
+
+    def _parse_weekend(self, values):
+        weekend = []
+        for value in values:
+            try:
+                wday = int(value)
+            except ValueError:
+                wday = -1
+            if 0 <= wday <= 6:
+                weekend.append(wday)
+            else:
+                self.log.warning('Invalid weekday %r in [ganttcalendar] weekend_days',
+                                 value)
+        return weekend
+
+    def _parse_holidays(self, values):
+        holidays = {}
+        for value in values:
+            period, _sep, desc = value.partition('=')
+            first, _sep, last = period.partition('..')
+            first = to_date(first)
+            last = to_date(last) if last else first
+            if not first or not last or first > last:
+                self.log.warning('Invalid holiday %r in [ganttcalendar] holidays', value)
+                continue
+            for i in range((last - first).days + 1):
+                holidays[first + timedelta(i)] = desc.strip() or None
+        return holidays
@@ -0,0 +1,151 @@
+import math
+from datetime import date, timedelta
+
+from trac.core import Component, implements
+from trac.config import FloatOption
+from trac.web import IRequestHandler
+from trac.web.chrome import add_stylesheet, add_ctxtnav
+
+from trac.project.api import ProjectManagement
+
+from ganttcalendar.api import ScheduleQuery, month_tbl, weekdays, add_months, \
+                               date_format, send_json, _
+from ganttcalendar.workcalendar import WorkingCalendar, WorkDays
+
+
+__all__ = ['TicketWorkload']
+
+
+def load_matrix(tickets, first, last, today, remaining=False, workdays=None):
+    """Return `(owners, hours)` where `hours[i][d]` is the load of
+    `owners[i]` on day `first + d` of `first`..`last`.
+
+    Hours of each ticket are spread evenly over working days of its
+    schedule according to `WorkDays` `workdays`, Monday to Friday by
+    default. With `remaining`, only hours left after the logged `totalhours`
+    are spread, from `today` on; work left of overdue tickets is put on the
+    next working day. Loads are accumulated with one difference
+    array per owner, in time linear to tickets plus owners times days.
+    """
+    workdays = workdays or WorkDays()
+    days = (last - first).days + 1
+    diffs = {}
+    for t in tickets:
+        hours = t['estimatedhours']
+        start, end = t['due_assign'], t['due_close']
+        if remaining:
+            if t['status'] == 'closed':
+                continue
+            hours = max(hours - (t['totalhours'] or 0), 0)
+            start = max(start, today)
+            end = max(end, today)
+        count = workdays.working_days(start, end)
+        if remaining and not count:
+            start = end = workdays.next_working(end)
+            if start is None:
+                continue
+            count = 1
+        if not hours or not count:
+            continue
+        start = max((start - first).days, 0)
+        end = min((end - first).days + 1, days)
+        if start >= end:
+            continue
+        diff = diffs.get(t['owner'])
+        if diff is None:
+            diff = diffs[t['owner']] = [0.0] * (days + 1)
+        rate = hours / count
+        diff[start] += rate
+        diff[end] -= rate
+
+    days_off = set(workdays.days_off(first, days))
+    owners = sorted(diffs)
+    matrix = []
+    for owner in owners:
+        diff = diffs[owner]
+        row = []
+        load = 0.0
+        for d in range(days):
+            load += diff[d]
+            row.append(d not in days_off and round(load, 2) or 0.0)
+        matrix.append(row)
+    return owners, matrix
+
+def load_level(hours, capacity):
+    """Return heatmap level of daily load: 0 for no load, 1 to 4 up to
+    `capacity`, 5 up to one and half of it and 6 above."""
+    if not hours:
+        return 0
+    ratio = hours / (capacity or 1)
+    if ratio > 1.5:
+        return 6
+    if ratio > 1:
+        return 5
+    return max(int(math.ceil(ratio * 4)), 1)
+
+
+class TicketWorkload(Component):
+    """Hours of scheduled tickets per owner and day."""
+
+    implements(IRequestHandler)
+
+    capacity = FloatOption('ganttcalendar', 'workload_capacity', '8',
+            doc='Working hours per day of an owner, used to color the workload view')
+
+    # IRequestHandler
+
+    def match_request(self, req):
+        return req.path_info.startswith('/ticketworkload')
+
+    def process_request(self, req):
+        req.perm.require('TICKET_VIEW')
+
+        pid = ProjectManagement(self.env).get_current_project(req)
+        ScheduleQuery(self.env).check_modified(req, pid)
+
+        year  = req.args.getint('year')
+        month = req.args.getint('month')
+        months = min(max(req.args.getint('months', 1), 1), 6)
+        remaining = req.args.getbool('remaining', False)
+        show_closed_ticket = not req.args.getbool('hide_closed_ticket', False)
+        selected_milestone = req.args.get('selected_milestone')
+        selected_component = req.args.get('selected_component')
+
+        today = date.today()
+        if year and month:
+            cday = date(year, month, 1)
+        else:
+            cday = today.replace(day=1)
+        first = cday
+        last = add_months(cday.year, cday.month, months) - timedelta(1)
+
+        tickets = ScheduleQuery(self.env).get_tickets(
+            pid, first, last, show_closed=show_closed_ticket, milestone=selected_milestone,
+            component=selected_component, description=False)[0]
+        tickets = [t for t in tickets if t['estimatedhours'] is not None]
+        workdays = WorkingCalendar(self.env).get_workdays(pid)
+        owners, hours = load_matrix(tickets, first, last, today, remaining, workdays)
+        days = [first + timedelta(d) for d in range((last - first).days + 1)]
+
+        if req.path_info == '/ticketworkload/data.json':
+            send_json(req, {
+                'first': first.isoformat(), 'last': last.isoformat(),
+                'capacity': self.capacity, 'owners': owners, 'hours': hours,
+            })
+
+        data = {
+            'current': cday, 'months': months, 'remaining': remaining,
+            'prev': add_months(cday.year, cday.month, -1),
+            'next': add_months(cday.year, cday.month, 1),
+            'show_closed_ticket': show_closed_ticket,
+            'days': days, 'today': today, 'owners': owners, 'hours': hours,
+            'is_working': workdays.is_working,
+            'totals': [round(sum(row), 2) for row in hours],
+            'capacity': self.capacity, 'load_level': load_level,
+            '_': _, 'date_format': date_format, 'month_tbl': month_tbl, 'weekdays': weekdays,
+        }
+
+        add_stylesheet(req, 'ganttcalendar/css/workload.css')
+        add_ctxtnav(req, _('Gantt chart'), req.href.ticketgantt())
+        add_ctxtnav(req, _('Calendar'), req.href.ticketcalendar())
+        return 'workload.html', data, None